@@ -1,7 +1,13 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
 
 
-from .models import Category, Post, Location
+from .forms import CommentPurgeForm
+from .models import Category, Comment, ImageJob, Post, Location
+from .moderation import PURGE_CHUNK_SIZE, purge_comments
 
 
 # Register your models here.
@@ -16,6 +22,7 @@ class PostAdmin(admin.ModelAdmin):
         'pub_date',
         'is_published',
         'created_at',
+        'comment_count',
     )
     list_editable = (
         'is_published',
@@ -47,3 +54,161 @@ class LocationAdmin(admin.ModelAdmin):
     list_editable = (
         'is_published',
     )
+
+
+@admin.register(Comment)
+class CommentAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk',
+        'text',
+        'post',
+        'author',
+        'created_at',
+    )
+    list_select_related = (
+        'post',
+        'author',
+    )
+    list_filter = (
+        'created_at',
+    )
+    search_fields = (
+        'author__username',
+    )
+    raw_id_fields = (
+        'post',
+        'author',
+    )
+    show_full_result_count = False
+    purge_chunk_size = PURGE_CHUNK_SIZE
+    change_list_template = 'admin/blog/comment/change_list.html'
+    actions = (
+        'purge_selected',
+        'purge_by_author',
+        'purge_by_post',
+    )
+
+    def get_readonly_fields(self, request, obj=None):
+        # Счётчик и снимок последних комментариев ведутся по публикации
+        # комментария; перенос между публикациями их не обновляет.
+        readonly_fields = super().get_readonly_fields(request, obj)
+        if obj is not None:
+            return (*readonly_fields, 'post')
+        return readonly_fields
+
+    def get_actions(self, request):
+        # Стандартное удаление загружает и показывает каждый объект.
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    @admin.action(
+        description='Удалить выбранные комментарии',
+        permissions=('delete',),
+    )
+    def purge_selected(self, request, queryset):
+        self.report_purged(
+            request, purge_comments(queryset, self.purge_chunk_size)
+        )
+
+    @admin.action(
+        description='Удалить все комментарии авторов выбранных',
+        permissions=('delete',),
+    )
+    def purge_by_author(self, request, queryset):
+        # Список, а не подзапрос: подзапрос выполнялся бы заново для
+        # каждой пачки и опустел бы, когда удалены выбранные строки.
+        authors = list(
+            queryset.order_by().values_list('author_id', flat=True).distinct()
+        )
+        self.report_purged(
+            request,
+            purge_comments(
+                Comment.objects.filter(author_id__in=authors),
+                self.purge_chunk_size,
+            ),
+        )
+
+    @admin.action(
+        description='Удалить все комментарии к публикациям выбранных',
+        permissions=('delete',),
+    )
+    def purge_by_post(self, request, queryset):
+        posts = list(
+            queryset.order_by().values_list('post_id', flat=True).distinct()
+        )
+        self.report_purged(
+            request,
+            purge_comments(
+                Comment.objects.filter(post_id__in=posts),
+                self.purge_chunk_size,
+            ),
+        )
+
+    def report_purged(self, request, deleted):
+        self.message_user(
+            request, f'Удалено комментариев: {deleted}.', messages.SUCCESS
+        )
+
+    def get_urls(self):
+        return [
+            path(
+                'purge/',
+                self.admin_site.admin_view(self.purge_view),
+                name='blog_comment_purge',
+            ),
+            *super().get_urls(),
+        ]
+
+    def purge_view(self, request):
+        """Удаление по автору, публикации и периоду с подтверждением."""
+        if not self.has_delete_permission(request):
+            raise PermissionDenied
+        form = CommentPurgeForm(
+            request.POST if request.method == 'POST' else None
+        )
+        matched = None
+        if form.is_valid():
+            queryset = form.get_queryset()
+            if 'confirm' in request.POST:
+                self.report_purged(
+                    request, purge_comments(queryset, self.purge_chunk_size)
+                )
+                return redirect(reverse('admin:blog_comment_changelist'))
+            matched = queryset.count()
+        return TemplateResponse(
+            request,
+            'admin/blog/comment/purge.html',
+            {
+                **self.admin_site.each_context(request),
+                'title': 'Очистка комментариев',
+                'opts': self.model._meta,
+                'form': form,
+                'matched': matched,
+            },
+        )
+
+
+@admin.register(ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk',
+        'post',
+        'image',
+        'status',
+        'attempts',
+        'run_after',
+        'updated_at',
+    )
+    list_select_related = (
+        'post',
+    )
+    list_filter = (
+        'status',
+    )
+    raw_id_fields = (
+        'post',
+    )
+    readonly_fields = (
+        'last_error',
+    )
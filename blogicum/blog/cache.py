@@ -0,0 +1,174 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+FEED_INDEX = 'index'
+
+POST_CARD_TEMPLATE = 'includes/post_card.html'
+
+
+def category_feed(category_id):
+    return f'category:{category_id}'
+
+
+def author_feed(author_id):
+    """Все публикации автора: так профиль видит сам автор."""
+    return f'author:{author_id}'
+
+
+def published_author_feed(author_id):
+    """Опубликованные публикации автора: так профиль видят остальные."""
+    return f'published-author:{author_id}'
+
+
+def feed_count_key(feed):
+    return f'blog:feed-count:{feed}'
+
+
+def next_publication_key(feed):
+    return f'blog:next-publication:{feed}'
+
+
+def invalidate_feeds(*feeds):
+    """Сбросить закешированные данные и версии перечисленных лент."""
+    cache.delete_many(
+        [feed_count_key(feed) for feed in feeds]
+        + [next_publication_key(feed) for feed in feeds]
+    )
+    bump_versions(*(version_key('feed', feed) for feed in feeds))
+
+
+def version_key(model_name, pk):
+    return f'blog:version:{model_name}:{pk}'
+
+
+def get_versions(keys):
+    """Текущие версии объектов; отсутствующие создаются заново.
+
+    Версия — метка времени последнего изменения объекта. Её сбрасывают
+    обработчики сигналов, поэтому ключи, построенные из версий, меняются
+    сами и старые записи кеша просто перестают читаться.
+    """
+    keys = set(keys)
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys - versions.keys()}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return versions
+
+
+def bump_versions(*keys):
+    cache.set_many(dict.fromkeys(keys, time.time_ns()), None)
+
+
+def category_key(slug):
+    return f'blog:category:{slug}'
+
+
+def get_published_category(slug):
+    """Опубликованная категория по slug или None, через кеш.
+
+    Запись, в том числе об отсутствии категории, сбрасывает обработчик
+    сигнала сохранения и удаления Category.
+    """
+    from .models import Category
+
+    key = category_key(slug)
+    entry = cache.get(key)
+    if entry is None:
+        entry = {
+            'category': Category.objects.filter(
+                slug=slug, is_published=True
+            ).first(),
+        }
+        cache.set(
+            key, entry, getattr(settings, 'BLOG_CATEGORY_TIMEOUT', 60 * 60)
+        )
+    return entry['category']
+
+
+def post_card_version_keys(post):
+    return (
+        version_key('post', post.pk),
+        version_key('category', post.category_id),
+        version_key('location', post.location_id),
+        version_key('user', post.author_id),
+    )
+
+
+def post_card_key(post, versions):
+    stamps = ':'.join(
+        str(versions[key]) for key in post_card_version_keys(post)
+    )
+    return f'blog:post-card:{post.pk}:{post.updated_at.timestamp()}:{stamps}'
+
+
+def render_post_cards(posts):
+    """HTML карточек публикаций: два обращения к кешу на всю страницу."""
+    posts = list(posts)
+    versions = get_versions(
+        key for post in posts for key in post_card_version_keys(post)
+    )
+    keys = [post_card_key(post, versions) for post in posts]
+    cards = cache.get_many(keys)
+    rendered = {
+        key: render_to_string(POST_CARD_TEMPLATE, {'post': post})
+        for key, post in zip(keys, posts)
+        if key not in cards
+    }
+    if rendered:
+        cache.set_many(
+            rendered, getattr(settings, 'BLOG_POST_CARD_TIMEOUT', 60 * 60)
+        )
+        cards.update(rendered)
+    return [mark_safe(cards[key]) for key in keys]
+
+
+def page_cache_key(request):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'blog:page:{path}'
+
+
+def get_cached_page(key):
+    """Запись страницы, если не изменилась ни одна из её зависимостей."""
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    if cache.get_many(entry['versions']) != entry['versions']:
+        return None
+    return entry
+
+
+def set_cached_page(key, response, versions, validators, timeout):
+    if timeout <= 0:
+        return
+    cache.set(
+        key,
+        {
+            'content': response.content,
+            'content_type': response['Content-Type'],
+            'versions': versions,
+            'validators': validators,
+        },
+        timeout,
+    )
+
+
+def get_page_validators(versions, viewer=None, last_modified=None):
+    """ETag и Last-Modified (Unix-время) страницы.
+
+    ``viewer`` — всё, что кроме версий влияет на страницу у конкретного
+    посетителя (пользователь, CSRF-токен в формах). Время изменения из базы
+    (``last_modified``) дополняется версиями: удаление объекта не
+    оставляет updated_at, а версию сбрасывает.
+    """
+    digest = hashlib.md5(repr((sorted(versions.items()), viewer)).encode())
+    timestamp = max(versions.values(), default=0) // 10 ** 9
+    if last_modified is not None:
+        timestamp = max(timestamp, int(last_modified.timestamp()))
+    return f'"{digest.hexdigest()}"', timestamp
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+PROCESS_LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """Кеш версий (blog.cache) должен быть общим для всех процессов."""
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [
+        Warning(
+            f'Кеш {backend} не общий для процессов приложения: изменения '
+            'публикаций, комментариев и категорий не сбросят страницы, '
+            'закешированные другими процессами.',
+            hint='Настройте в CACHES общий кеш: Redis, Memcached, '
+            'FileBasedCache или DatabaseCache.',
+            id='blog.W001',
+        )
+    ]
@@ -0,0 +1,261 @@
+"""Очередь комментариев с отложенной записью в базу.
+
+Если задан ``BLOG_COMMENT_QUEUE_DIR``, новый комментарий не пишется в
+базу во время запроса, а сохраняется отдельным файлом в каталоге
+очереди. Команда ``process_comment_queue`` забирает файлы пачками и
+добавляет комментарии одним ``bulk_create`` на пачку, так что при наплыве
+комментариев база получает редкие крупные записи вместо блокировок на
+каждом POST.
+
+Файл очереди сначала пишется во временный, сбрасывается на диск и только
+потом переименовывается, поэтому в очереди не бывает недописанных
+записей. Обработчик переносит взятые файлы в ``processing/`` и удаляет их
+после фиксации транзакции; записи, которые не удалось разобрать,
+попадают в ``failed/``. Имя файла содержит публикацию и автора: по нему
+автор видит свои ещё не записанные комментарии без чтения базы.
+"""
+import json
+import os
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .cache import bump_versions, version_key
+from .models import Comment, Post
+from .utils import update_comment_counts, update_latest_comments
+
+User = get_user_model()
+
+PROCESSING_DIR = 'processing'
+FAILED_DIR = 'failed'
+SUFFIX = '.json'
+BATCH_SIZE = 500
+
+
+def get_queue_dir():
+    return getattr(settings, 'BLOG_COMMENT_QUEUE_DIR', None)
+
+
+def is_enabled():
+    return bool(get_queue_dir())
+
+
+def _path(*parts):
+    return os.path.join(get_queue_dir(), *parts)
+
+
+def _entry_name(post_id, author_id):
+    return f'{time.time_ns():020d}-{post_id}-{author_id}-{uuid.uuid4().hex}'
+
+
+def _parse_name(name):
+    _, post_id, author_id, _ = name[:-len(SUFFIX)].split('-')
+    return int(post_id), int(author_id)
+
+
+def _entries(*parts):
+    try:
+        names = os.listdir(_path(*parts))
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names if name.endswith(SUFFIX))
+
+
+def enqueue_comment(post_id, author_id, text):
+    """Поставить комментарий в очередь; возвращает имя записи."""
+    queue_dir = get_queue_dir()
+    os.makedirs(queue_dir, exist_ok=True)
+    name = _entry_name(post_id, author_id) + SUFFIX
+    data = json.dumps({
+        'post_id': post_id,
+        'author_id': author_id,
+        'text': text,
+        'created_at': timezone.now().isoformat(),
+    })
+    temporary = _path(f'.{name}.tmp')
+    with open(temporary, 'w', encoding='utf-8') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, _path(name))
+    return name
+
+
+def get_pending_comments(post, author):
+    """Ещё не записанные в базу комментарии автора к публикации.
+
+    Возвращает несохранённые экземпляры ``Comment`` в порядке постановки
+    в очередь.
+    """
+    if not is_enabled() or not author.is_authenticated:
+        return []
+    comments = []
+    for parts in ((), (PROCESSING_DIR,)):
+        for name in _entries(*parts):
+            if _parse_name(name) != (post.pk, author.pk):
+                continue
+            entry = _read(_path(*parts, name))
+            if entry is None:
+                continue
+            comments.append(Comment(
+                text=entry['text'],
+                post=post,
+                author=author,
+                created_at=parse_datetime(entry['created_at']),
+            ))
+    return sorted(comments, key=lambda comment: comment.created_at)
+
+
+def _read(path):
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def _claim(names):
+    os.makedirs(_path(PROCESSING_DIR), exist_ok=True)
+    claimed = []
+    for name in names:
+        try:
+            os.replace(_path(name), _path(PROCESSING_DIR, name))
+        except FileNotFoundError:
+            # Запись уже забрал другой обработчик.
+            continue
+        claimed.append(name)
+    return claimed
+
+
+def _fail(name):
+    os.makedirs(_path(FAILED_DIR), exist_ok=True)
+    os.replace(_path(PROCESSING_DIR, name), _path(FAILED_DIR, name))
+
+
+def process_batch(names, deduplicate=False):
+    """Записать взятые в обработку записи в базу.
+
+    Возвращает пару (добавлено, пропущено). Записи к удалённым
+    публикациям или от удалённых пользователей пропускаются. При
+    ``deduplicate`` пропускаются и комментарии, которые уже есть в базе
+    (та же публикация, автор, текст и время отправки): так повторно
+    обрабатываются записи, оставшиеся в ``processing/`` после сбоя между
+    фиксацией транзакции и удалением файлов.
+    """
+    entries = {}
+    for name in names:
+        try:
+            entry = _read(_path(PROCESSING_DIR, name))
+            if entry is None:
+                continue
+            created_at = parse_datetime(entry['created_at'])
+            if created_at is None:
+                raise ValueError(entry['created_at'])
+            entries[name] = (
+                int(entry['post_id']),
+                int(entry['author_id']),
+                str(entry['text']),
+                created_at,
+            )
+        except (ValueError, TypeError, KeyError):
+            _fail(name)
+    if not entries:
+        return 0, 0
+    post_ids = set(Post.objects.filter(
+        pk__in={entry[0] for entry in entries.values()}
+    ).values_list('pk', flat=True))
+    author_ids = set(User.objects.filter(
+        pk__in={entry[1] for entry in entries.values()}
+    ).values_list('pk', flat=True))
+    existing = set()
+    if deduplicate:
+        existing = set(Comment.objects.filter(
+            post_id__in=post_ids,
+            created_at__gte=min(entry[3] for entry in entries.values()),
+        ).values_list('post_id', 'author_id', 'text', 'created_at'))
+    # Комментарий получает время отправки, а не время записи в базу:
+    # так он не меняется после записи и встаёт в ветку на своё место.
+    comments = [
+        Comment(
+            post_id=post_id,
+            author_id=author_id,
+            text=text,
+            created_at=created_at,
+        )
+        for post_id, author_id, text, created_at in entries.values()
+        if post_id in post_ids
+        and author_id in author_ids
+        and (post_id, author_id, text, created_at) not in existing
+    ]
+    touched = {comment.post_id for comment in comments}
+    with transaction.atomic():
+        Comment.objects.bulk_create(comments)
+        update_comment_counts(
+            Post.objects.filter(pk__in=touched), updated_at=timezone.now()
+        )
+        update_latest_comments(touched)
+    bump_versions(
+        *(version_key('post', post_id) for post_id in touched),
+        *(
+            version_key('user-comments', author_id)
+            for author_id in {comment.author_id for comment in comments}
+        ),
+    )
+    for name in entries:
+        os.remove(_path(PROCESSING_DIR, name))
+    return len(comments), len(entries) - len(comments)
+
+
+def drain(batch_size=BATCH_SIZE):
+    """Обработать очередь целиком; возвращает пару (добавлено, пропущено).
+
+    Пачки берутся в порядке постановки в очередь. Если запись пачки в
+    базу не удалась, её файлы возвращаются в очередь.
+    """
+    added = skipped = 0
+    while True:
+        names = _claim(_entries()[:batch_size])
+        if not names:
+            return added, skipped
+        try:
+            batch_added, batch_skipped = process_batch(names)
+        except Exception:
+            _release(names)
+            raise
+        added += batch_added
+        skipped += batch_skipped
+
+
+def _release(names):
+    for name in names:
+        try:
+            os.replace(_path(PROCESSING_DIR, name), _path(name))
+        except FileNotFoundError:
+            continue
+
+
+def replay(batch_size=BATCH_SIZE, include_failed=False):
+    """Дообработать записи, оставшиеся в ``processing/`` после сбоя.
+
+    Запускайте, когда другие обработчики очереди остановлены. С
+    ``include_failed`` записи из ``failed/`` сначала возвращаются в
+    обработку. Возвращает пару (добавлено, пропущено).
+    """
+    if include_failed:
+        os.makedirs(_path(PROCESSING_DIR), exist_ok=True)
+        for name in _entries(FAILED_DIR):
+            os.replace(_path(FAILED_DIR, name), _path(PROCESSING_DIR, name))
+    added = skipped = 0
+    names = _entries(PROCESSING_DIR)
+    for start in range(0, len(names), batch_size):
+        batch_added, batch_skipped = process_batch(
+            names[start:start + batch_size], deduplicate=True
+        )
+        added += batch_added
+        skipped += batch_skipped
+    return added, skipped
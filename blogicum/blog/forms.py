@@ -1,7 +1,9 @@
 from django import forms
 from django.contrib.auth import get_user_model
 
+from . import image_jobs
 from .models import Comment, Post
+from .uploads import ImageUploadField
 
 User = get_user_model()
 
@@ -25,6 +27,41 @@ class PostForm(forms.ModelForm):
         widgets = {
             'pub_date': forms.DateTimeInput(attrs={'type': 'datetime-local'})
         }
+        field_classes = {
+            'image': ImageUploadField,
+        }
+
+    def __init__(self, *args, rejected_uploads=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rejected_uploads = rejected_uploads or {}
+
+    def clean(self):
+        # Файлы, отброшенные CappedUploadHandler, до формы не доходят.
+        for field, message in self.rejected_uploads.items():
+            if field in self.fields:
+                self.add_error(field, message)
+        return super().clean()
+
+    def save(self, commit=True):
+        # Варианты нового изображения строит обработчик заданий; до тех
+        # пор шаблоны показывают оригинал.
+        if 'image' not in self.changed_data:
+            return super().save(commit)
+        self.instance.image_variants = {}
+        post = super().save(commit)
+        if not self.cleaned_data['image']:
+            return post
+        if commit:
+            image_jobs.enqueue(post)
+        else:
+            save_m2m = self.save_m2m
+
+            def save_m2m_and_enqueue():
+                save_m2m()
+                image_jobs.enqueue(post)
+
+            self.save_m2m = save_m2m_and_enqueue
+        return post
 
 
 class CommentForm(forms.ModelForm):
@@ -32,3 +69,46 @@ class CommentForm(forms.ModelForm):
     class Meta:
         model = Comment
         fields = ('text',)
+
+
+class CommentPurgeForm(forms.Form):
+    author = forms.CharField(label='Имя пользователя', required=False)
+    post = forms.IntegerField(label='ID публикации', required=False)
+    created_from = forms.DateTimeField(
+        label='Добавлены не раньше',
+        required=False,
+        widget=forms.DateTimeInput(attrs={'type': 'datetime-local'}),
+    )
+    created_to = forms.DateTimeField(
+        label='Добавлены раньше',
+        required=False,
+        widget=forms.DateTimeInput(attrs={'type': 'datetime-local'}),
+    )
+
+    def clean_author(self):
+        username = self.cleaned_data['author']
+        if not username:
+            return None
+        try:
+            return User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise forms.ValidationError('Такого пользователя нет.')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not any(cleaned_data.values()):
+            raise forms.ValidationError('Укажите хотя бы одно условие.')
+        return cleaned_data
+
+    def get_queryset(self):
+        lookups = {
+            'author': 'author',
+            'post': 'post_id',
+            'created_from': 'created_at__gte',
+            'created_to': 'created_at__lt',
+        }
+        return Comment.objects.filter(**{
+            lookup: self.cleaned_data[field]
+            for field, lookup in lookups.items()
+            if self.cleaned_data.get(field) is not None
+        })
@@ -0,0 +1,157 @@
+"""Построение вариантов изображений вне запроса.
+
+Форма публикации только сохраняет оригинал и ставит задание в таблицу
+``ImageJob``; пока варианты не готовы, шаблоны показывают оригинал.
+Команда ``process_image_jobs`` забирает задания из таблицы и строит
+варианты в локальном пуле процессов: Pillow держит GIL лишь частично, а
+процессы не мешают друг другу и обработчику запросов.
+
+Задание относится к конкретному файлу (``ImageJob.image``): если
+изображение публикации успели заменить, результат старого задания
+отбрасывается. Упавшее задание повторяется с растущей паузой, после
+``MAX_ATTEMPTS`` попыток оно помечается как неудавшееся.
+"""
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import django
+from django.apps import apps
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from .cache import bump_versions, version_key
+from .images import build_variants
+from .models import ImageJob, Post
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = timedelta(seconds=30)
+# Задание в работе дольше этого считается брошенным упавшим обработчиком.
+STALE_AFTER = timedelta(minutes=10)
+
+
+def enqueue(post):
+    """Поставить в очередь построение вариантов текущего изображения."""
+    return ImageJob.objects.create(post=post, image=post.image.name)
+
+
+def recover_stale(now=None):
+    """Вернуть в очередь задания, брошенные упавшим обработчиком."""
+    now = now or timezone.now()
+    return ImageJob.objects.filter(
+        status=ImageJob.RUNNING, updated_at__lt=now - STALE_AFTER
+    ).update(status=ImageJob.PENDING, run_after=now, updated_at=now)
+
+
+def claim(limit):
+    """Забрать до ``limit`` готовых к выполнению заданий.
+
+    Каждое задание переводится в работу условным UPDATE, поэтому
+    несколько обработчиков не возьмут одно задание дважды.
+    """
+    now = timezone.now()
+    candidates = list(ImageJob.objects.filter(
+        status=ImageJob.PENDING, run_after__lte=now
+    ).order_by('run_after', 'id').values_list('pk', flat=True)[:limit])
+    claimed = [
+        pk for pk in candidates
+        if ImageJob.objects.filter(pk=pk, status=ImageJob.PENDING).update(
+            status=ImageJob.RUNNING,
+            attempts=F('attempts') + 1,
+            updated_at=now,
+        )
+    ]
+    return list(ImageJob.objects.filter(pk__in=claimed).order_by('pk'))
+
+
+def render_variants(name):
+    """Выполняется в процессе пула: только файлы, без обращений к базе."""
+    storage = Post._meta.get_field('image').storage
+    with storage.open(name, 'rb') as file:
+        return build_variants(file)
+
+
+def init_worker():
+    if not apps.ready:
+        django.setup()
+
+
+def complete(job, variants):
+    now = timezone.now()
+    # Изображение могли заменить, пока задание выполнялось: тогда
+    # UPDATE не найдёт строку, а варианты построит новое задание.
+    updated = Post.objects.filter(pk=job.post_id, image=job.image).update(
+        image_variants=variants, updated_at=now
+    )
+    if updated:
+        bump_versions(version_key('post', job.post_id))
+    ImageJob.objects.filter(pk=job.pk).update(
+        status=ImageJob.DONE, last_error='', updated_at=now
+    )
+
+
+def fail(job, error):
+    now = timezone.now()
+    changes = {'last_error': error, 'updated_at': now}
+    if job.attempts >= MAX_ATTEMPTS:
+        changes['status'] = ImageJob.FAILED
+    else:
+        changes['status'] = ImageJob.PENDING
+        changes['run_after'] = now + RETRY_DELAY * 2 ** (job.attempts - 1)
+    ImageJob.objects.filter(pk=job.pk).update(**changes)
+
+
+def skip_obsolete(jobs):
+    """Отметить выполненными задания для уже заменённых изображений."""
+    current = dict(Post.objects.filter(
+        pk__in={job.post_id for job in jobs}
+    ).values_list('pk', 'image'))
+    obsolete = {
+        job.pk for job in jobs if current.get(job.post_id) != job.image
+    }
+    ImageJob.objects.filter(pk__in=obsolete).update(
+        status=ImageJob.DONE, updated_at=timezone.now()
+    )
+    return [job for job in jobs if job.pk not in obsolete]
+
+
+def process(batch_size, workers=None):
+    """Выполнить одну пачку заданий; возвращает пару (готово, ошибок).
+
+    Пул создаётся на пачку: если процесс пула упадёт (например, на
+    изображении, которому не хватило памяти), это затронет только
+    задания этой пачки, и они будут повторены.
+    """
+    jobs = skip_obsolete(claim(batch_size))
+    if not jobs:
+        return 0, 0
+    done = failed = 0
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker
+    ) as executor:
+        futures = [
+            (job, executor.submit(render_variants, job.image))
+            for job in jobs
+        ]
+        for job, future in futures:
+            try:
+                variants = future.result()
+            except Exception:
+                fail(job, traceback.format_exc())
+                failed += 1
+            else:
+                complete(job, variants)
+                done += 1
+    close_old_connections()
+    return done, failed
+
+
+def retry_failed():
+    """Вернуть неудавшиеся задания в очередь с новым запасом попыток."""
+    return ImageJob.objects.filter(status=ImageJob.FAILED).update(
+        status=ImageJob.PENDING,
+        attempts=0,
+        run_after=timezone.now(),
+        updated_at=timezone.now(),
+    )
@@ -0,0 +1,200 @@
+"""Уменьшенные копии изображений публикаций.
+
+Для каждого изображения строятся варианты ``VARIANTS`` нескольких
+ширин в форматах ``FORMATS``. Копии сохраняются без метаданных (EXIF,
+ICC, комментариев) после поворота по EXIF-ориентации, а их имена,
+размеры и размеры оригинала лежат в ``Post.image_variants``:
+
+    {'width': 4000, 'height': 3000,
+     'card': {'webp': [{'name': ..., 'width': 320, 'height': 180}, ...],
+              'jpeg': [...]},
+     'detail': {...}}
+
+Варианты строит не запрос, а обработчик заданий (``blog.image_jobs``)
+из уже сохранённого оригинала. Имена копий строятся по хешу содержимого
+оригинала, поэтому у одинаковых изображений копии общие.
+"""
+import hashlib
+import os
+import posixpath
+import re
+import time
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+VARIANTS_DIR = 'post_images/variants'
+
+CONTENT_HASH = re.compile(r'[0-9a-f]{64}')
+
+# Сколько секунд после повторной загрузки файл нельзя удалять: за это время
+# публикация, повторно загрузившая то же содержимое, успевает сохраниться.
+REUSE_GRACE = 10 * 60
+
+# Карточка ленты шириной 40rem: 1x, 2x и узкие экраны; картинка
+# обрезается до 16:9. На странице публикации пропорции сохраняются.
+VARIANTS = {
+    'card': {'widths': (320, 640, 1280), 'aspect': (16, 9)},
+    'detail': {'widths': (640, 1280, 1920), 'aspect': None},
+}
+
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 6},
+    'jpeg': {
+        'format': 'JPEG', 'quality': 82, 'optimize': True,
+        'progressive': True,
+    },
+}
+
+CONTENT_TYPES = {
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+}
+
+
+def content_hash(file):
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(64 * 1024), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def open_image(file):
+    """Открыть изображение, повернуть по EXIF и привести к RGB."""
+    file.seek(0)
+    with Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            return background
+        return image.convert('RGB')
+
+
+def get_widths(name, original_width):
+    """Ширины варианта без увеличения: хотя бы одна, не шире оригинала."""
+    widths = [
+        width for width in VARIANTS[name]['widths'] if width <= original_width
+    ]
+    return widths or [original_width]
+
+
+def resize(image, name, width):
+    aspect = VARIANTS[name]['aspect']
+    if aspect is None:
+        height = max(round(image.height * width / image.width), 1)
+        return image.resize((width, height), Image.LANCZOS)
+    height = max(round(width * aspect[1] / aspect[0]), 1)
+    return ImageOps.fit(image, (width, height), Image.LANCZOS)
+
+
+def encode(image, fmt):
+    buffer = BytesIO()
+    # Метаданные не переносятся: у новой картинки нет ни EXIF, ни ICC.
+    image.save(buffer, **FORMATS[fmt])
+    return buffer.getvalue()
+
+
+def build_variants(file, storage=default_storage):
+    """Построить и сохранить варианты изображения из файла ``file``."""
+    digest = content_hash(file)
+    image = open_image(file)
+    variants = {'width': image.width, 'height': image.height}
+    for name in VARIANTS:
+        variants[name] = {fmt: [] for fmt in FORMATS}
+        for width in get_widths(name, image.width):
+            resized = resize(image, name, width)
+            for fmt in FORMATS:
+                path = (
+                    f'{VARIANTS_DIR}/{digest[:2]}/'
+                    f'{digest}-{name}-{width}.{fmt}'
+                )
+                if not storage.exists(path):
+                    path = storage.save(
+                        path, ContentFile(encode(resized, fmt))
+                    )
+                variants[name][fmt].append({
+                    'name': path,
+                    'width': resized.width,
+                    'height': resized.height,
+                })
+    return variants
+
+
+def get_srcset(variants, name, fmt, storage=default_storage):
+    return ', '.join(
+        f'{storage.url(entry["name"])} {entry["width"]}w'
+        for entry in variants[name][fmt]
+    )
+
+
+def release_image(name):
+    """Удалить файл изображения и его варианты, если он больше не нужен.
+
+    Файлы в хранилище общие для публикаций с одинаковым содержимым,
+    поэтому удаляются только когда на имя не ссылается ни одна
+    публикация. Проверка и удаление выполняются после фиксации
+    транзакции, удалившей или изменившей публикацию.
+    """
+    if name:
+        transaction.on_commit(lambda: delete_unused_image(name))
+
+
+def delete_unused_image(name, min_age=0):
+    """Удалить файл ``name`` и его варианты, если на них нет ссылок.
+
+    Возвращает True, если файл удалён. Файл, который недавно загрузили
+    ещё раз (см. ``ContentAddressedStorage.lease_path``), остаётся:
+    публикация с ним может быть ещё не сохранена. Такие файлы потом
+    удаляет команда ``delete_unused_images``; она же передаёт
+    ``min_age``, чтобы не трогать только что загруженные файлы.
+    """
+    from .models import Post
+
+    storage = Post._meta.get_field('image').storage
+    digest = posixpath.splitext(posixpath.basename(name))[0]
+    with storage.lock(name):
+        if Post.objects.filter(image=name).exists():
+            return False
+        lease = storage.lease_path(name)
+        try:
+            if age(storage.path(name)) < min_age:
+                return False
+            if os.path.exists(lease) and age(lease) < REUSE_GRACE:
+                return False
+        except FileNotFoundError:
+            return False
+        if not CONTENT_HASH.fullmatch(digest):
+            # Файл загружен до хранилища по содержимому: хеш считаем заново.
+            with storage.open(name, 'rb') as file:
+                digest = content_hash(file)
+        storage.delete(name)
+        if os.path.exists(lease):
+            os.remove(lease)
+    # Варианты общие для всех файлов с тем же содержимым, в том числе
+    # загруженных до хранилища по содержимому под другими именами.
+    if not Post.objects.filter(image__contains=digest).exists():
+        delete_variants(digest)
+    return True
+
+
+def age(path):
+    """Сколько секунд назад изменён файл."""
+    return time.time() - os.path.getmtime(path)
+
+
+def delete_variants(digest, storage=default_storage):
+    directory = f'{VARIANTS_DIR}/{digest[:2]}'
+    try:
+        files = storage.listdir(directory)[1]
+    except FileNotFoundError:
+        return
+    for filename in files:
+        if filename.startswith(f'{digest}-'):
+            storage.delete(f'{directory}/{filename}')
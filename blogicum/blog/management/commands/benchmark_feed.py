@@ -0,0 +1,170 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from blog.models import Category, Post
+
+User = get_user_model()
+
+BENCH_PREFIX = 'bench-'
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу тестовыми публикациями и сравнивает планы запросов '
+        'и время выборки лент без индексов и с индексами Post.Meta.indexes. '
+        'Запускайте только на отдельной базе данных.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1_000_000)
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--authors', type=int, default=1000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--database', default='default')
+        parser.add_argument(
+            '--noinput', '--no-input',
+            action='store_false',
+            dest='interactive',
+            help='Не спрашивать подтверждения перед заполнением базы.',
+        )
+
+    def handle(self, *args, **options):
+        self.using = options['database']
+        self.repeat = options['repeat']
+        if options['interactive']:
+            answer = input(
+                f'В базу "{self.using}" будет добавлено до '
+                f'{options["posts"]} публикаций. Продолжить? [y/N] '
+            )
+            if answer.lower() != 'y':
+                raise CommandError('Отменено.')
+        self.seed(options)
+        queries = self.get_queries()
+        indexes = Post._meta.indexes
+        connection = connections[self.using]
+        with connection.schema_editor() as schema_editor:
+            for index in indexes:
+                schema_editor.remove_index(Post, index)
+        try:
+            self.analyze()
+            before = self.measure('Без индексов', queries)
+        finally:
+            with connection.schema_editor() as schema_editor:
+                for index in indexes:
+                    schema_editor.add_index(Post, index)
+        self.analyze()
+        after = self.measure('С индексами', queries)
+        self.stdout.write(self.style.MIGRATE_HEADING('Итог, медиана, мс'))
+        for name in queries:
+            self.stdout.write(
+                f'  {name}: {before[name]:.2f} -> {after[name]:.2f}'
+            )
+
+    def seed(self, options):
+        posts = Post.objects.using(self.using)
+        missing = options['posts'] - posts.filter(
+            title__startswith=BENCH_PREFIX
+        ).count()
+        if missing <= 0:
+            return
+        authors = [
+            User(username=f'{BENCH_PREFIX}{number}')
+            for number in range(options['authors'])
+        ]
+        User.objects.using(self.using).bulk_create(
+            authors, ignore_conflicts=True
+        )
+        authors = list(
+            User.objects.using(self.using).filter(
+                username__startswith=BENCH_PREFIX
+            ).values_list('pk', flat=True)
+        )
+        categories = [
+            Category(
+                title=f'{BENCH_PREFIX}{number}',
+                description='',
+                slug=f'{BENCH_PREFIX}{number}',
+                is_published=number % 10 != 0,
+            )
+            for number in range(options['categories'])
+        ]
+        Category.objects.using(self.using).bulk_create(
+            categories, ignore_conflicts=True
+        )
+        categories = list(
+            Category.objects.using(self.using).filter(
+                slug__startswith=BENCH_PREFIX
+            ).values_list('pk', flat=True)
+        )
+        now = timezone.now()
+        minutes = (-5 * 365 * 24 * 60, 30 * 24 * 60)
+        batch_size = options['batch_size']
+        self.stdout.write(f'Добавление публикаций: {missing}')
+        for offset in range(0, missing, batch_size):
+            posts.bulk_create(
+                Post(
+                    title=f'{BENCH_PREFIX}{offset + number}',
+                    text='Lorem ipsum dolor sit amet. ' * 20,
+                    pub_date=now + timedelta(minutes=random.randint(*minutes)),
+                    is_published=random.random() > 0.05,
+                    author_id=random.choice(authors),
+                    category_id=random.choice(categories),
+                )
+                for number in range(min(batch_size, missing - offset))
+            )
+
+    def get_queries(self):
+        posts = Post.objects.using(self.using)
+        category = Category.objects.using(self.using).filter(
+            slug__startswith=BENCH_PREFIX, is_published=True
+        ).first()
+        author = User.objects.using(self.using).filter(
+            username__startswith=BENCH_PREFIX
+        ).first()
+        return {
+            'Главная, 1-я страница': (
+                lambda: posts.published().for_feed()[:10], list,
+            ),
+            'Главная, число публикаций': (
+                lambda: posts.published(), lambda queryset: queryset.count(),
+            ),
+            'Категория, 1-я страница': (
+                lambda: posts.published().filter(
+                    category=category
+                ).for_feed()[:10],
+                list,
+            ),
+            'Профиль, 1-я страница': (
+                lambda: posts.filter(author=author).for_feed()[:10], list,
+            ),
+        }
+
+    def analyze(self):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def measure(self, title, queries):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        results = {}
+        for name, (get_queryset, evaluate) in queries.items():
+            self.stdout.write(f'  {name}')
+            for line in get_queryset().explain().splitlines():
+                self.stdout.write(f'    {line}')
+            evaluate(get_queryset())
+            timings = []
+            for _ in range(self.repeat):
+                queryset = get_queryset()
+                started = time.perf_counter()
+                evaluate(queryset)
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = statistics.median(timings)
+            self.stdout.write(f'    {results[name]:.2f} мс')
+        return results
@@ -0,0 +1,38 @@
+import posixpath
+
+from django.core.management.base import BaseCommand
+
+from blog.images import REUSE_GRACE, VARIANTS_DIR, delete_unused_image
+from blog.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет файлы изображений публикаций, на которые не ссылается ни '
+        'одна публикация, вместе с их вариантами. Файлы моложе '
+        f'{REUSE_GRACE // 60} минут не трогает: их публикации могут быть '
+        'ещё не сохранены.'
+    )
+
+    def handle(self, *args, **options):
+        storage = Post._meta.get_field('image').storage
+        upload_to = Post._meta.get_field('image').upload_to
+        deleted = 0
+        for name in self.get_names(storage, upload_to):
+            if delete_unused_image(name, min_age=REUSE_GRACE):
+                deleted += 1
+        self.stdout.write(self.style.SUCCESS(f'Удалено файлов: {deleted}'))
+
+    def get_names(self, storage, directory):
+        try:
+            directories, files = storage.listdir(directory)
+        except FileNotFoundError:
+            return
+        for filename in files:
+            # Скрытые файлы — блокировки, метки и недописанные загрузки.
+            if not filename.startswith('.'):
+                yield posixpath.join(directory, filename)
+        for subdirectory in directories:
+            path = posixpath.join(directory, subdirectory)
+            if path != VARIANTS_DIR:
+                yield from self.get_names(storage, path)
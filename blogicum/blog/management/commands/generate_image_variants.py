@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from blog.cache import bump_versions, version_key
+from blog.images import build_variants
+from blog.models import ImageJob, Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Строит уменьшенные копии изображений публикаций, у которых их ещё '
+        'нет (с --force — у всех).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'post_ids',
+            nargs='*',
+            type=int,
+            help='Идентификаторы публикаций; по умолчанию — все.',
+        )
+        parser.add_argument('--force', action='store_true')
+        parser.add_argument(
+            '--enqueue',
+            action='store_true',
+            help='Не строить сразу, а поставить задания process_image_jobs.',
+        )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').only('pk', 'image')
+        if options['post_ids']:
+            posts = posts.filter(pk__in=options['post_ids'])
+        if not options['force']:
+            posts = posts.filter(image_variants={})
+        if options['enqueue']:
+            jobs = ImageJob.objects.bulk_create(
+                ImageJob(post=post, image=post.image.name)
+                for post in posts.iterator()
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f'Поставлено заданий: {len(jobs)}'
+            ))
+            return
+        done = failed = 0
+        for post in posts.iterator():
+            try:
+                with post.image.open('rb') as file:
+                    variants = build_variants(file)
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'#{post.pk} {post.image.name}: {error}')
+                continue
+            # Без сигналов: меняется только картинка карточки, ленты и
+            # счётчики сбрасывать не нужно.
+            Post.objects.filter(pk=post.pk).update(
+                image_variants=variants, updated_at=timezone.now()
+            )
+            bump_versions(version_key('post', post.pk))
+            done += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано публикаций: {done}, с ошибками: {failed}'
+        ))
@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import comment_queue
+
+
+class Command(BaseCommand):
+    help = (
+        'Записывает в базу комментарии из очереди BLOG_COMMENT_QUEUE_DIR. '
+        'С --watch работает как фоновый обработчик.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=comment_queue.BATCH_SIZE
+        )
+        parser.add_argument(
+            '--watch',
+            action='store_true',
+            help=(
+                'Не завершаться, а проверять каталог очереди каждые '
+                '--interval с.'
+            ),
+        )
+        parser.add_argument('--interval', type=float, default=1.0)
+        parser.add_argument(
+            '--replay',
+            action='store_true',
+            help=(
+                'Сначала дообработать записи, оставшиеся в processing/ '
+                'после сбоя. Другие обработчики должны быть остановлены.'
+            ),
+        )
+        parser.add_argument(
+            '--include-failed',
+            action='store_true',
+            help='Вместе с --replay вернуть в обработку записи из failed/.',
+        )
+
+    def handle(self, *args, **options):
+        if not comment_queue.is_enabled():
+            raise CommandError('Не задан BLOG_COMMENT_QUEUE_DIR.')
+        batch_size = options['batch_size']
+        if options['replay']:
+            self.report('Повторно', *comment_queue.replay(
+                batch_size, include_failed=options['include_failed']
+            ))
+        while True:
+            added, skipped = comment_queue.drain(batch_size)
+            if added or skipped or not options['watch']:
+                self.report('Из очереди', added, skipped)
+            if not options['watch']:
+                return
+            time.sleep(options['interval'])
+
+    def report(self, title, added, skipped):
+        self.stdout.write(self.style.SUCCESS(
+            f'{title}: добавлено {added}, пропущено {skipped}'
+        ))
@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog import image_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Строит варианты изображений по заданиям ImageJob в локальном пуле '
+        'процессов. С --watch работает как фоновый обработчик.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Число процессов пула; по умолчанию — по числу ядер.',
+        )
+        parser.add_argument(
+            '--watch',
+            action='store_true',
+            help=(
+                'Не завершаться, а искать новые задания ImageJob каждые '
+                '--interval с.'
+            ),
+        )
+        parser.add_argument('--interval', type=float, default=2.0)
+        parser.add_argument(
+            '--retry-failed',
+            action='store_true',
+            help='Сначала вернуть в очередь неудавшиеся задания.',
+        )
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            self.stdout.write(
+                f'Возвращено в очередь: {image_jobs.retry_failed()}'
+            )
+        total_done = total_failed = 0
+        while True:
+            image_jobs.recover_stale()
+            done, failed = image_jobs.process(
+                options['batch_size'], options['workers']
+            )
+            if done or failed:
+                self.stdout.write(f'Готово: {done}, с ошибками: {failed}')
+            total_done += done
+            total_failed += failed
+            if done or failed:
+                continue
+            if not options['watch']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Всего готово: {total_done}, с ошибками: {total_failed}'
+        ))
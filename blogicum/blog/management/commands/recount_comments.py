@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import Post
+from blog.utils import update_comment_counts, update_latest_comments
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счётчики и снимки последних комментариев у '
+        'публикаций с нуля.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'post_ids',
+            nargs='*',
+            type=int,
+            help='Идентификаторы публикаций; по умолчанию — все.',
+        )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.all()
+        if options['post_ids']:
+            posts = posts.filter(pk__in=options['post_ids'])
+        updated = update_comment_counts(posts)
+        update_latest_comments(posts.values_list('pk', flat=True).iterator())
+        self.stdout.write(
+            self.style.SUCCESS(f'Пересчитано публикаций: {updated}')
+        )
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from blog.cache import FEED_INDEX, category_feed
+from blog.scheduling import FEED_FIELDS, get_feed_posts, get_valid_until
+
+
+class Command(BaseCommand):
+    help = (
+        'Показывает отложенные публикации ленты и момент, до которого '
+        'закешированные результаты ленты остаются верными.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--feed',
+            default=FEED_INDEX,
+            help='Лента: index, category:<id> или author:<id>.',
+        )
+        parser.add_argument('--limit', type=int, default=20)
+
+    def handle(self, *args, **options):
+        feed = options['feed']
+        kind = feed.partition(':')[0]
+        if feed != FEED_INDEX and kind not in FEED_FIELDS:
+            raise CommandError(f'Неизвестная лента: {feed}')
+        posts = get_feed_posts(feed).scheduled().select_related(
+            'author', 'category'
+        ).order_by('pub_date')[:options['limit']]
+        valid_until = get_valid_until(feed)
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Лента {feed}'))
+        if valid_until is None:
+            self.stdout.write('  Отложенных публикаций нет.')
+            return
+        self.stdout.write(f'  Кеш верен до {self.format(valid_until)}')
+        for post in posts:
+            self.stdout.write(
+                f'  {self.format(post.pub_date)}  '
+                f'#{post.pk} «{post.title}» @{post.author.username} '
+                f'[{category_feed(post.category_id)}]'
+            )
+
+    @staticmethod
+    def format(moment):
+        return f'{timezone.localtime(moment):%Y-%m-%d %H:%M:%S}'
@@ -0,0 +1,202 @@
+"""Раздача загруженных файлов (``MEDIA_ROOT``).
+
+Файлы с хешем содержимого в имени (изображения публикаций и их
+варианты, см. ``blog.storage`` и ``blog.images``) никогда не меняются,
+поэтому отдаются с ``Cache-Control: immutable`` на год, а ETag берётся
+из имени без чтения файла. Остальным файлам ETag строится по времени
+изменения и размеру, и кешируются они на ``BLOG_MEDIA_MAX_AGE`` секунд.
+
+Если перед приложением стоит nginx или Apache, сам файл отдаёт он:
+``BLOG_MEDIA_ACCEL`` включает ответ с ``X-Accel-Redirect`` или
+``X-Sendfile``, а Range и условные запросы обрабатывает прокси. Без
+прокси файл отдаётся ``FileResponse`` с поддержкой одного диапазона
+Range; WSGI-сервер с ``wsgi.file_wrapper`` (gunicorn) передаёт его
+через sendfile, не копируя в Python.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags
+from django.views import View
+
+CONTENT_ADDRESSED = re.compile(r'[0-9a-f]{64}(?:[-.]|$)')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+RANGE = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+def get_accel():
+    return getattr(settings, 'BLOG_MEDIA_ACCEL', None)
+
+
+def get_accel_prefix():
+    return getattr(settings, 'BLOG_MEDIA_ACCEL_PREFIX', '/internal-media/')
+
+
+def get_max_age():
+    return getattr(settings, 'BLOG_MEDIA_MAX_AGE', 60 * 60)
+
+
+def is_content_addressed(name):
+    return bool(CONTENT_ADDRESSED.match(posixpath.basename(name)))
+
+
+def get_etag(name, stat_result):
+    if is_content_addressed(name):
+        return f'"{posixpath.basename(name)}"'
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def etag_matches(etag, header):
+    """Слабое сравнение ETag, как требует If-None-Match."""
+    etags = parse_etags(header)
+    return '*' in etags or etag in (
+        value[2:] if value.startswith('W/') else value for value in etags
+    )
+
+
+def parse_range(header, size):
+    """Разобрать заголовок Range в пару (начало, длина).
+
+    Поддерживается один диапазон; для нескольких диапазонов или
+    непонятного заголовка возвращается None — файл отдаётся целиком, как
+    разрешает RFC 7233. Для диапазона за концом файла — ValueError.
+    """
+    match = RANGE.fullmatch(header.replace(' ', ''))
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        length = min(int(last), size)
+        if not length:
+            raise ValueError(header)
+        return size - length, length
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, end - start + 1
+
+
+class FileRange:
+    """Часть открытого файла для FileResponse.
+
+    ``fileno()`` отдаётся как есть, а файл заранее перемотан на начало
+    диапазона: gunicorn передаёт через sendfile ``Content-Length`` байт
+    с текущей позиции. Остальные серверы читают через ``read()``,
+    который не выходит за конец диапазона.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class MediaFileResponse(FileResponse):
+    block_size = 64 * 1024
+
+
+class MediaView(View):
+    """Отдаёт файл из MEDIA_ROOT по пути ``path``."""
+
+    def get(self, request, path):
+        name = posixpath.normpath(path).lstrip('/')
+        # Скрытые файлы — это, например, недописанные загрузки хранилища.
+        if any(part.startswith('.') for part in name.split('/')):
+            raise Http404
+        try:
+            full_path = safe_join(settings.MEDIA_ROOT, name)
+            stat_result = os.stat(full_path)
+        except (SuspiciousFileOperation, OSError):
+            raise Http404
+        if not stat.S_ISREG(stat_result.st_mode):
+            raise Http404
+        etag = get_etag(name, stat_result)
+        headers = {
+            'ETag': etag,
+            'Last-Modified': http_date(stat_result.st_mtime),
+            'Cache-Control': self.get_cache_control(name),
+        }
+        if etag_matches(etag, request.META.get('HTTP_IF_NONE_MATCH', '')):
+            return self.with_headers(HttpResponse(status=304), headers)
+        content_type = (
+            mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        )
+        if get_accel():
+            response = self.offload(name, full_path)
+            response['Content-Type'] = content_type
+            return self.with_headers(response, headers)
+        return self.with_headers(
+            self.serve(request, full_path, stat_result.st_size, etag),
+            dict(headers, **{'Content-Type': content_type}),
+        )
+
+    def get_cache_control(self, name):
+        if is_content_addressed(name):
+            return f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+        return f'public, max-age={get_max_age()}'
+
+    def offload(self, name, full_path):
+        response = HttpResponse()
+        if get_accel() == 'x-sendfile':
+            response['X-Sendfile'] = full_path
+        else:
+            response['X-Accel-Redirect'] = get_accel_prefix() + quote(name)
+        return response
+
+    def serve(self, request, full_path, size, etag):
+        header = request.META.get('HTTP_RANGE')
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if header and if_range and if_range != etag:
+            header = None
+        try:
+            byte_range = parse_range(header, size) if header else None
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        start, length = byte_range or (0, size)
+        if request.method == 'HEAD':
+            response = HttpResponse()
+        else:
+            file = open(full_path, 'rb')
+            response = MediaFileResponse(
+                FileRange(file, start, length) if byte_range else file
+            )
+        response['Content-Length'] = str(length)
+        response['Accept-Ranges'] = 'bytes'
+        if byte_range:
+            response.status_code = 206
+            response['Content-Range'] = (
+                f'bytes {start}-{start + length - 1}/{size}'
+            )
+        return response
+
+    @staticmethod
+    def with_headers(response, headers):
+        for header, value in headers.items():
+            response[header] = value
+        return response
@@ -0,0 +1,44 @@
+# Generated by Django 3.2.16 on 2026-10-18 02:55
+
+from django.db import migrations, models
+
+LATEST_COMMENTS_SIZE = 20
+
+
+def fill_latest_comments(apps, schema_editor):
+    Comment = apps.get_model('blog', 'Comment')
+    Post = apps.get_model('blog', 'Post')
+    for post in Post.objects.filter(comment_count__gt=0).only('pk'):
+        comments = Comment.objects.filter(post_id=post.pk).order_by(
+            '-created_at', '-id'
+        ).values_list(
+            'id', 'author_id', 'author__username', 'text', 'created_at'
+        )[:LATEST_COMMENTS_SIZE]
+        post.latest_comments = [
+            {
+                'id': pk,
+                'author_id': author_id,
+                'author': username,
+                'text': text,
+                'created_at': created_at.isoformat(),
+            }
+            for pk, author_id, username, text, created_at
+            in reversed(comments)
+        ]
+        post.save(update_fields=['latest_comments'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0014_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='latest_comments',
+            field=models.JSONField(default=list, editable=False, verbose_name='Последние комментарии'),
+        ),
+        migrations.RunPython(fill_latest_comments, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,9 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
+
+from .storage import post_image_storage
+from .utils import PostQuerySet
 
 
 User = get_user_model()
@@ -13,6 +17,11 @@ class BaseModel(models.Model):
         'Добавлено',
         auto_now_add=True,
     )
+    updated_at = models.DateTimeField(
+        'Изменено',
+        auto_now=True,
+        db_index=True,
+    )
     is_published = models.BooleanField(
         'Опубликовано',
         default=True,
@@ -97,20 +106,52 @@ class Post(BaseModel):
     image = models.ImageField(
         'Изображение публикации',
         upload_to='post_images',
+        storage=post_image_storage,
         blank=True,
+        # По имени файла считаются ссылки на него (blog.images).
+        db_index=True,
+    )
+    image_variants = models.JSONField(
+        'Варианты изображения',
+        default=dict,
+        editable=False,
+    )
+    comment_count = models.PositiveIntegerField(
+        'Количество комментариев',
+        default=0,
+        editable=False,
     )
+    latest_comments = models.JSONField(
+        'Последние комментарии',
+        default=list,
+        editable=False,
+    )
+
+    objects = PostQuerySet.as_manager()
 
     def __str__(self) -> str:
         return self.title
 
-    def comment_count(self):
-        comments = self.comments
-        return comments.count()
-
     class Meta:
         verbose_name = 'публикация'
         verbose_name_plural = 'Публикации'
         ordering = ('-pub_date',)
+        indexes = (
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='post_feed_idx',
+                condition=models.Q(is_published=True),
+            ),
+            models.Index(
+                fields=('category', '-pub_date', '-id'),
+                name='post_category_feed_idx',
+                condition=models.Q(is_published=True),
+            ),
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='post_author_feed_idx',
+            ),
+        )
 
 
 class Comment(models.Model):
@@ -121,18 +162,100 @@ class Comment(models.Model):
         Post,
         verbose_name='Публикация',
         on_delete=models.CASCADE,
-        related_name='comments'
+        related_name='comments',
+        db_index=False,
     )
+    # Не auto_now_add: очередь комментариев (blog.comment_queue) сохраняет
+    # время отправки, а не время записи в базу.
     created_at = models.DateTimeField(
-        auto_now_add=True,
+        default=timezone.now,
+        editable=False,
+    )
+    updated_at = models.DateTimeField(
+        'Изменено',
+        auto_now=True,
+        db_index=True,
     )
     author = models.ForeignKey(
         User,
         verbose_name='Пользователь',
         on_delete=models.CASCADE,
+        db_index=False,
     )
 
     class Meta:
         verbose_name = 'комментарий'
         verbose_name_plural = 'Комментарии'
         ordering = ('created_at',)
+        # Заменяют одиночные индексы внешних ключей: ветка комментариев
+        # публикации и комментарии пользователя читаются по индексу уже
+        # в нужном порядке, без отдельной сортировки.
+        indexes = (
+            models.Index(
+                fields=('post', 'created_at', 'id'),
+                name='comment_post_thread_idx',
+            ),
+            models.Index(
+                fields=('author', 'created_at', 'id'),
+                name='comment_author_idx',
+            ),
+        )
+
+    def delete(self, *args, **kwargs):
+        # Публикация обновляется здесь, а не в post_delete: обработчик
+        # удаления заставил бы каскад от публикации или пользователя
+        # загружать и удалять комментарии по одному (см. blog.signals).
+        from .moderation import update_deleted_comment_post
+
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            result = super().delete(*args, **kwargs)
+            update_deleted_comment_post(self)
+        return result
+
+
+class ImageJob(models.Model):
+    """Задание на построение вариантов изображения публикации."""
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнено'),
+        (FAILED, 'Не удалось'),
+    )
+
+    post = models.ForeignKey(
+        Post,
+        verbose_name='Публикация',
+        on_delete=models.CASCADE,
+        related_name='image_jobs',
+    )
+    image = models.CharField('Изображение', max_length=256)
+    status = models.CharField(
+        'Состояние',
+        max_length=16,
+        choices=STATUSES,
+        default=PENDING,
+    )
+    attempts = models.PositiveSmallIntegerField('Попытки', default=0)
+    run_after = models.DateTimeField('Не раньше', default=timezone.now)
+    last_error = models.TextField('Последняя ошибка', blank=True)
+    created_at = models.DateTimeField('Добавлено', auto_now_add=True)
+    updated_at = models.DateTimeField('Изменено', auto_now=True)
+
+    def __str__(self) -> str:
+        return f'{self.image} ({self.get_status_display()})'
+
+    class Meta:
+        verbose_name = 'задание обработки изображения'
+        verbose_name_plural = 'Задания обработки изображений'
+        indexes = (
+            models.Index(
+                fields=('run_after', 'id'),
+                name='imagejob_pending_idx',
+                condition=models.Q(status='pending'),
+            ),
+        )
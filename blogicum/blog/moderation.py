@@ -0,0 +1,58 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .cache import bump_versions, version_key
+from .models import Comment, Post
+from .utils import (
+    get_latest_comments, update_comment_counts, update_latest_comments,
+)
+
+PURGE_CHUNK_SIZE = 1000
+
+
+def purge_comments(queryset, chunk_size=PURGE_CHUNK_SIZE):
+    """Удалить комментарии из queryset пачками, не загружая объекты.
+
+    Каждая пачка — отдельная транзакция из DELETE по первичным ключам и
+    пересчёта счётчиков затронутых публикаций, поэтому таблицу не
+    блокирует одна длинная транзакция, а счётчики всегда согласованы.
+    Сигналы post_delete не отправляются. Возвращает число удалённых строк.
+    """
+    queryset = queryset.order_by('pk').values_list(
+        'pk', 'post_id', 'author_id'
+    )
+    deleted = 0
+    while True:
+        rows = list(queryset[:chunk_size])
+        if not rows:
+            return deleted
+        pks, post_ids, author_ids = map(set, zip(*rows))
+        with transaction.atomic(using=queryset.db):
+            chunk = Comment.objects.using(queryset.db).filter(pk__in=pks)
+            deleted += chunk._raw_delete(queryset.db)
+            update_comment_counts(
+                Post.objects.using(queryset.db).filter(pk__in=post_ids),
+                updated_at=timezone.now(),
+            )
+            update_latest_comments(post_ids, using=queryset.db)
+        bump_versions(
+            *(version_key('post', post_id) for post_id in post_ids),
+            *(
+                version_key('user-comments', author_id)
+                for author_id in author_ids
+            ),
+        )
+
+
+def update_deleted_comment_post(comment):
+    """Счётчик, снимок и версии после удаления одного комментария."""
+    Post.objects.filter(pk=comment.post_id, comment_count__gt=0).update(
+        comment_count=F('comment_count') - 1,
+        latest_comments=get_latest_comments(comment.post_id),
+        updated_at=timezone.now(),
+    )
+    bump_versions(
+        version_key('post', comment.post_id),
+        version_key('user-comments', comment.author_id),
+    )
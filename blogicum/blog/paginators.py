@@ -0,0 +1,225 @@
+import binascii
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from .cache import feed_count_key
+from .scheduling import get_feed_timeout
+
+
+# Целые за пределами 64 бит не принимает ни одна поддерживаемая СУБД, а
+# SQLite не задаёт полям границ, и run_validators их не проверяет.
+MAX_INTEGER = 2 ** 63 - 1
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values, reverse=False):
+    payload = [
+        {'dt': value.isoformat()} if isinstance(value, datetime) else value
+        for value in values
+    ]
+    data = json.dumps({'v': payload, 'r': reverse}, separators=(',', ':'))
+    return urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, fields):
+    """Значения и направление из курсора; значения — по полям ``fields``.
+
+    Каждое значение приводится и проверяется полем модели, поэтому
+    подделанный курсор даёт InvalidCursor, а не ошибку в запросе.
+    """
+    try:
+        data = json.loads(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        values = [
+            parse_datetime(value['dt']) if isinstance(value, dict) else value
+            for value in data['v']
+        ]
+        reverse = bool(data['r'])
+        if len(values) != len(fields) or None in values:
+            raise ValueError(cursor)
+        values = [
+            field.to_python(value) for field, value in zip(fields, values)
+        ]
+        for field, value in zip(fields, values):
+            field.run_validators(value)
+            if isinstance(value, int) and abs(value) > MAX_INTEGER:
+                raise ValueError(cursor)
+    except (
+        binascii.Error, ValueError, TypeError, KeyError, ValidationError
+    ):
+        raise InvalidCursor(cursor)
+    return values, reverse
+
+
+class CursorPage:
+
+    def __init__(self, object_list, paginator, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self.object_list)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Постраничный вывод по ключу сортировки вместо OFFSET.
+
+    Страница выбирается условием по значениям полей ``ordering`` у
+    последней показанной записи, поэтому стоимость запроса не зависит от
+    глубины страницы, а общее количество записей не считается.
+    """
+
+    template_name = 'includes/cursor_paginator.html'
+
+    def __init__(self, object_list, per_page, ordering=('-pub_date', '-id')):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [field.lstrip('-') for field in self.ordering]
+
+    def get_page(self, cursor):
+        """Вернуть страницу; неверный курсор ведёт на первую страницу."""
+        values, reverse = None, False
+        if cursor:
+            try:
+                values, reverse = decode_cursor(cursor, [
+                    self.object_list.model._meta.get_field(field)
+                    for field in self.fields
+                ])
+            except InvalidCursor:
+                pass
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(self._flip(field) for field in ordering)
+        queryset = self.object_list.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self._seek(ordering, values))
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+        return CursorPage(
+            rows,
+            self,
+            self._cursor(rows[-1]) if rows and has_next else None,
+            self._cursor(rows[0], reverse=True)
+            if rows and has_previous else None,
+        )
+
+    def _cursor(self, obj, reverse=False):
+        return encode_cursor(
+            [getattr(obj, field) for field in self.fields], reverse
+        )
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def _seek(self, ordering, values):
+        # (a, b) < (x, y) раскрывается в a <= x AND (a < x OR a = x AND b < y):
+        # первое условие даёт базе диапазон по индексу.
+        lookups = [
+            (field.lstrip('-'), 'lt' if field.startswith('-') else 'gt')
+            for field in ordering
+        ]
+        condition = Q()
+        for position, (field, lookup) in enumerate(lookups):
+            branch = Q(**{f'{field}__{lookup}': values[position]})
+            for previous, value in zip(lookups[:position], values):
+                branch &= Q(**{previous[0]: value})
+            condition |= branch
+        first_field, first_lookup = lookups[0]
+        return Q(**{f'{first_field}__{first_lookup}e': values[0]}) & condition
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator, который берёт общее количество записей из кеша.
+
+    Ключ строится по имени ленты ``feed`` (см. ``blog.cache``), сбрасывают
+    его обработчики сигналов при изменении публикаций, а срок хранения
+    ограничен моментом ближайшей отложенной публикации. Если задан
+    ``BLOG_FEED_COUNT_ESTIMATE_THRESHOLD``, на PostgreSQL вместо точного
+    COUNT(*) для больших лент используется оценка планировщика.
+    """
+
+    def __init__(self, object_list, per_page, feed=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.feed = feed
+
+    @cached_property
+    def count(self):
+        if self.feed is None:
+            return super().count
+        key = feed_count_key(self.feed)
+        count = cache.get(key)
+        if count is None:
+            count = self.estimate_count()
+            if count is None:
+                count = super().count
+            timeout = get_feed_timeout(
+                self.feed,
+                getattr(settings, 'BLOG_FEED_COUNT_TIMEOUT', 60 * 60),
+            )
+            if timeout > 0:
+                cache.set(key, count, timeout)
+        return count
+
+    def estimate_count(self):
+        threshold = getattr(
+            settings, 'BLOG_FEED_COUNT_ESTIMATE_THRESHOLD', None
+        )
+        queryset = self.object_list
+        if threshold is None or not hasattr(queryset, 'explain'):
+            return None
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        # Не QuerySet.explain(): Django 3.2 превращает разобранный
+        # psycopg2 JSON в repr списка, и json.loads на нём падает.
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        try:
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = int(plan[0]['Plan']['Plan Rows'])
+        except (ValueError, TypeError, LookupError):
+            return None
+        return estimate if estimate >= threshold else None
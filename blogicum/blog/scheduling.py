@@ -0,0 +1,64 @@
+"""Отложенные публикации и срок годности закешированных лент.
+
+Лента меняется не только при записи в базу, но и когда наступает
+``pub_date`` отложенной публикации. Модуль хранит в кеше время ближайшей
+такой публикации для каждой ленты и по нему вычисляет, до какого момента
+закешированный результат ленты остаётся верным.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .cache import FEED_INDEX, next_publication_key
+from .models import Post
+from .utils import get_next_publication_time
+
+FEED_FIELDS = {
+    'category': 'category_id',
+    'author': 'author_id',
+    'published-author': 'author_id',
+}
+
+
+def get_feed_posts(feed):
+    """Публикации ленты по её имени: index, category:<id>, author:<id>."""
+    if feed == FEED_INDEX:
+        return Post.objects.all()
+    kind, _, pk = feed.partition(':')
+    return Post.objects.filter(**{FEED_FIELDS[kind]: pk})
+
+
+def get_next_publication(feed):
+    key = next_publication_key(feed)
+    entry = cache.get(key)
+    if entry is None:
+        entry = {'at': get_next_publication_time(get_feed_posts(feed))}
+        timeout = getattr(settings, 'BLOG_SCHEDULE_TIMEOUT', 60 * 60)
+        if entry['at'] is not None:
+            timeout = min(timeout, seconds_until(entry['at']))
+        cache.set(key, entry, timeout)
+    return entry['at']
+
+
+def get_valid_until(feed):
+    """Момент, после которого закешированная лента может устареть.
+
+    ``None`` — лента изменится только при записи в базу, а об этом
+    позаботятся обработчики сигналов.
+    """
+    next_publication = get_next_publication(feed)
+    if next_publication is not None and next_publication <= timezone.now():
+        return timezone.now()
+    return next_publication
+
+
+def get_feed_timeout(feed, timeout):
+    """Срок хранения результата ленты в секундах, не больше ``timeout``."""
+    valid_until = get_valid_until(feed)
+    if valid_until is None:
+        return timeout
+    return min(timeout, seconds_until(valid_until))
+
+
+def seconds_until(moment):
+    return max(int((moment - timezone.now()).total_seconds()) + 1, 0)
@@ -0,0 +1,199 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import F
+from django.db.models.signals import (
+    post_delete, post_init, post_save, pre_delete,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import (
+    FEED_INDEX, author_feed, bump_versions, category_feed, category_key,
+    invalidate_feeds, published_author_feed, version_key,
+)
+from .images import release_image
+from .models import Category, Comment, Location, Post
+from .utils import (
+    get_latest_comments, update_comment_counts, update_latest_comments,
+)
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Comment)
+def update_comment_post(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    changes = {'latest_comments': get_latest_comments(instance.post_id)}
+    # CommentCreateView обновляет счётчик сам, вместе с проверкой публикации.
+    if not (created and instance.__dict__.pop('_post_counted', False)):
+        changes['updated_at'] = timezone.now()
+        if created:
+            changes['comment_count'] = F('comment_count') + 1
+    Post.objects.filter(pk=instance.post_id).update(**changes)
+
+
+@receiver(post_init, sender=Post)
+def remember_post_category(sender, instance, **kwargs):
+    # Через __dict__, чтобы не загружать отложенное поле.
+    instance._loaded_category_id = instance.__dict__.get('category_id')
+
+
+@receiver(post_init, sender=Post)
+def remember_post_image(sender, instance, **kwargs):
+    instance._loaded_image = getattr(
+        instance.__dict__.get('image'), 'name', instance.__dict__.get('image')
+    )
+
+
+@receiver(post_save, sender=Post)
+def release_replaced_image(sender, instance, **kwargs):
+    if 'image' not in instance.__dict__:
+        return
+    if instance._loaded_image != instance.image.name:
+        release_image(instance._loaded_image)
+    instance._loaded_image = instance.image.name
+
+
+@receiver(pre_delete, sender=Post)
+def remember_post_commenters(sender, instance, **kwargs):
+    instance._commenter_ids = list(
+        instance.comments.order_by().values_list(
+            'author_id', flat=True
+        ).distinct()
+    )
+
+
+@receiver(post_delete, sender=Post)
+def bump_commenter_versions(sender, instance, **kwargs):
+    # Комментарии удалены каскадом вместе с публикацией.
+    bump_versions(*(
+        version_key('user-comments', author_id)
+        for author_id in instance.__dict__.pop('_commenter_ids', ())
+    ))
+
+
+@receiver(post_delete, sender=Post)
+def release_deleted_image(sender, instance, **kwargs):
+    if 'image' in instance.__dict__:
+        release_image(instance.image.name)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_feeds(sender, instance, **kwargs):
+    feeds = {
+        FEED_INDEX,
+        author_feed(instance.author_id),
+        published_author_feed(instance.author_id),
+        category_feed(instance.category_id),
+        category_feed(instance._loaded_category_id),
+    }
+    invalidate_feeds(*feeds)
+    instance._loaded_category_id = instance.category_id
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_feeds(sender, instance, **kwargs):
+    invalidate_feeds(FEED_INDEX, category_feed(instance.pk))
+
+
+@receiver(post_init, sender=Category)
+def remember_category_slug(sender, instance, **kwargs):
+    instance._loaded_slug = instance.__dict__.get('slug')
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_header(sender, instance, **kwargs):
+    cache.delete_many({
+        category_key(instance.slug), category_key(instance._loaded_slug),
+    })
+    instance._loaded_slug = instance.slug
+
+
+@receiver(post_save, sender=Category)
+@receiver(pre_delete, sender=Category)
+def invalidate_category_author_feeds(sender, instance, **kwargs):
+    # Публикация видна в профиле только вместе со своей категорией. При
+    # удалении авторов ищем до того, как у публикаций обнулится категория.
+    authors = Post.objects.filter(
+        category_id=instance.pk
+    ).order_by().values_list('author_id', flat=True).distinct()
+    invalidate_feeds(*map(published_author_feed, authors))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+def bump_object_version(sender, instance, **kwargs):
+    bump_versions(version_key(sender._meta.model_name, instance.pk))
+
+
+# Обработчиков удаления у Comment нет намеренно: с ними каскад загружал бы
+# комментарии и удалял их по одному. Удаление одного комментария
+# обрабатывает Comment.delete, каскад — обработчики Post и User ниже.
+@receiver(post_save, sender=Comment)
+def bump_comment_post_version(sender, instance, **kwargs):
+    bump_versions(
+        version_key('post', instance.post_id),
+        version_key('user-comments', instance.author_id),
+    )
+
+
+@receiver(post_init, sender=User)
+def remember_username(sender, instance, **kwargs):
+    instance._loaded_username = instance.__dict__.get('username')
+
+
+def get_commented_posts(user):
+    return list(
+        Comment.objects.filter(author_id=user.pk).order_by().values_list(
+            'post_id', flat=True
+        ).distinct()
+    )
+
+
+@receiver(pre_delete, sender=User)
+def remember_commented_posts(sender, instance, **kwargs):
+    instance._commented_posts = get_commented_posts(instance)
+
+
+@receiver(post_delete, sender=User)
+def update_commented_posts(sender, instance, **kwargs):
+    # Комментарии пользователя удалены каскадом одним запросом: счётчики и
+    # снимки затронутых публикаций пересчитываются по разу на публикацию.
+    # Строки удалённых вместе с пользователем публикаций UPDATE не найдёт.
+    post_ids = instance._commented_posts
+    update_comment_counts(
+        Post.objects.filter(pk__in=post_ids), updated_at=timezone.now()
+    )
+    update_latest_comments(post_ids)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def bump_user_version(sender, instance, update_fields=None, **kwargs):
+    # Вход пользователя обновляет только last_login — карточки не меняются.
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    # Имя автора выводится и в комментариях: страницы этих публикаций
+    # тоже должны устареть. После удаления комментариев уже нет — берём
+    # список, запомненный до удаления.
+    commented_posts = instance.__dict__.pop('_commented_posts', None)
+    if commented_posts is None:
+        commented_posts = get_commented_posts(instance)
+    if kwargs.get('created') is False and (
+        instance.username != instance._loaded_username
+    ):
+        # Имя хранится и в снимках последних комментариев.
+        update_latest_comments(commented_posts)
+        instance._loaded_username = instance.username
+    bump_versions(
+        version_key('user', instance.pk),
+        *(version_key('post', post_id) for post_id in commented_posts),
+    )
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import posixpath
+import tempfile
+from contextlib import contextmanager
+
+from django.core.files import locks
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from PIL import Image
+
+# Расширение по формату содержимого, а не по имени загрузки: одному хешу
+# соответствует одно имя (photo.jpeg и photo.jpg — один файл).
+IMAGE_EXTENSIONS = {
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'GIF': '.gif',
+    'WEBP': '.webp',
+}
+
+LOCK_NAME = '.lock'
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, где имя файла — SHA-256 его содержимого.
+
+    Загрузка пишется во временный файл рядом с целевым каталогом, по пути
+    считается хеш, и файл переименовывается в ``<каталог>/<xx>/<хеш><.ext>``.
+    Одинаковое содержимое хранится один раз: если такой файл уже есть,
+    временный просто удаляется, а рядом с существующим обновляется метка
+    повторной загрузки (``lease_path``). Удаляет файлы
+    ``blog.images.release_image``, когда на них не ссылается ни одна
+    публикация; повторное использование и удаление выполняются под
+    блокировкой ``lock``.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Итоговое имя выбирает _save по содержимому; совпадение имён —
+        # это совпадение содержимого, суффиксы не нужны.
+        return name
+
+    @contextmanager
+    def lock(self, name):
+        """Исключительная блокировка каталога файла ``name``."""
+        directory = self.path(posixpath.dirname(name))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, LOCK_NAME), 'ab') as file:
+            locks.lock(file, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(file)
+
+    def lease_path(self, name):
+        """Метка повторной загрузки файла ``name``."""
+        directory, filename = posixpath.split(name)
+        return self.path(posixpath.join(directory, f'.{filename}.reused'))
+
+    def _save(self, name, content):
+        directory = posixpath.dirname(name)
+        os.makedirs(self.path(directory), exist_ok=True)
+        digest = hashlib.sha256()
+        descriptor, temporary = tempfile.mkstemp(
+            dir=self.path(directory), prefix='.upload-'
+        )
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    file.write(chunk)
+            hexdigest = digest.hexdigest()
+            name = posixpath.join(
+                directory,
+                hexdigest[:2],
+                hexdigest + self.get_extension(temporary, name),
+            )
+            path = self.path(name)
+            with self.lock(name):
+                if os.path.exists(path):
+                    # Метка не даёт удалить файл, пока публикация с ним ещё
+                    # не сохранена (blog.images.delete_unused_image).
+                    with open(self.lease_path(name), 'ab'):
+                        pass
+                    os.utime(self.lease_path(name))
+                    os.remove(temporary)
+                    return name
+                if self.file_permissions_mode is not None:
+                    os.chmod(temporary, self.file_permissions_mode)
+                os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return name
+
+    @staticmethod
+    def get_extension(path, name):
+        try:
+            with Image.open(path) as image:
+                extension = IMAGE_EXTENSIONS.get(image.format)
+        except (OSError, ValueError):
+            extension = None
+        return extension or posixpath.splitext(name)[1].lower()
+
+
+post_image_storage = ContentAddressedStorage()
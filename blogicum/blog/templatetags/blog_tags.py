@@ -0,0 +1,35 @@
+from django import template
+from django.core.files.storage import default_storage
+
+from blog.cache import render_post_cards
+from blog.images import CONTENT_TYPES, FORMATS, get_srcset
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_cards(posts):
+    """Кешированные карточки: {% post_cards page_obj as cards %}."""
+    return render_post_cards(posts)
+
+
+@register.inclusion_tag('includes/post_image.html')
+def post_image(post, variant, sizes):
+    """<picture> с WebP и JPEG нужной ширины; без вариантов — оригинал."""
+    variants = post.image_variants
+    if variant not in variants:
+        return {'post': post}
+    fallback = variants[variant]['jpeg'][-1]
+    return {
+        'post': post,
+        'sizes': sizes,
+        'sources': [
+            {'type': CONTENT_TYPES[fmt], 'srcset': get_srcset(
+                variants, variant, fmt
+            )}
+            for fmt in FORMATS
+        ],
+        'src': default_storage.url(fallback['name']),
+        'width': fallback['width'],
+        'height': fallback['height'],
+    }
@@ -1 +1,1756 @@
-# Create your tests here.
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import tracemalloc
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.template import Context, Template
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image, ImageFile
+
+from . import comment_queue, image_jobs, images
+from .admin import CommentAdmin
+from .cache import (
+    FEED_INDEX, get_published_category, get_versions, render_post_cards,
+    version_key,
+)
+from .checks import check_shared_cache
+from .forms import PostForm
+from .images import build_variants
+from .models import Category, Comment, ImageJob, Location, Post
+from .paginators import CachedCountPaginator, CursorPaginator, encode_cursor
+from .storage import post_image_storage
+from .utils import get_feed_last_modified, get_last_modified
+from .views import (
+    FeedPaginationMixin, PostCreateView, PostDetailView, PostListView,
+)
+
+User = get_user_model()
+
+
+class BlogTestCase(TestCase):
+    """Общие данные тестов: автор, опубликованная категория и публикации."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author')
+        cls.category = Category.objects.create(
+            title='Категория', description='Описание', slug='category'
+        )
+
+    @classmethod
+    def create_post(cls, **kwargs):
+        """Вчерашняя публикация автора в категории; поля можно заменить."""
+        return Post.objects.create(**{
+            'title': 'Публикация',
+            'text': 'Текст',
+            'pub_date': timezone.now() - timedelta(days=1),
+            'author': cls.author,
+            'category': cls.category,
+            **kwargs,
+        })
+
+
+class CommentWriteQueriesTest(BlogTestCase):
+    """Число запросов на запись комментариев не должно расти незаметно.
+
+    В каждое значение входят два запроса аутентификации (сессия и
+    пользователь), а также SAVEPOINT/RELEASE вокруг транзакции. Запись
+    комментария пересобирает снимок Post.latest_comments: один SELECT.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.reader = User.objects.create(username='reader')
+        cls.post = cls.create_post()
+        cls.scheduled_post = cls.create_post(
+            title='Отложенная публикация',
+            pub_date=timezone.now() + timedelta(days=1),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+        self.comment = Comment.objects.create(
+            post=self.post, author=self.reader, text='Комментарий'
+        )
+
+    def comment_url(self, name, post=None):
+        post = post or self.post
+        return reverse(
+            f'blog:{name}',
+            kwargs={'post_id': post.pk, 'comment_id': self.comment.pk},
+        )
+
+    def test_add_comment(self):
+        url = reverse('blog:add_comment', kwargs={'post_id': self.post.pk})
+        with self.assertNumQueries(8):
+            response = self.client.post(url, {'text': 'Новый'})
+        self.assertRedirects(
+            response,
+            reverse('blog:post_detail', kwargs={'post_id': self.post.pk}),
+            fetch_redirect_response=False,
+        )
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 2)
+
+    def test_add_comment_to_hidden_post(self):
+        url = reverse(
+            'blog:add_comment', kwargs={'post_id': self.scheduled_post.pk}
+        )
+        with self.assertNumQueries(6):
+            response = self.client.post(url, {'text': 'Новый'})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(self.scheduled_post.comments.exists())
+
+    def test_add_comment_to_own_hidden_post(self):
+        self.client.force_login(self.author)
+        url = reverse(
+            'blog:add_comment', kwargs={'post_id': self.scheduled_post.pk}
+        )
+        self.client.post(url, {'text': 'Новый'})
+        self.scheduled_post.refresh_from_db()
+        self.assertEqual(self.scheduled_post.comment_count, 1)
+
+    def test_edit_comment_form(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(self.comment_url('edit_comment'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_edit_comment(self):
+        with self.assertNumQueries(6):
+            response = self.client.post(
+                self.comment_url('edit_comment'), {'text': 'Исправлено'}
+            )
+        self.assertEqual(response.status_code, 302)
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.text, 'Исправлено')
+
+    def test_delete_comment_form(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(self.comment_url('delete_comment'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_delete_comment(self):
+        with self.assertNumQueries(8):
+            response = self.client.post(self.comment_url('delete_comment'))
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Comment.objects.filter(pk=self.comment.pk).exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 0)
+
+    def test_delete_post_deletes_comments_at_once(self):
+        for number in range(50):
+            Comment.objects.create(
+                post=self.post, author=self.reader, text=f'Спам {number}'
+            )
+        key = version_key('user-comments', self.reader.pk)
+        version = get_versions([key])[key]
+        # Комментаторы, удаление комментариев одним запросом и публикации.
+        with self.assertNumQueries(4):
+            self.post.delete()
+        self.assertFalse(Comment.objects.exists())
+        self.assertNotEqual(get_versions([key])[key], version)
+
+    def test_delete_user_recounts_commented_posts(self):
+        for number in range(50):
+            Comment.objects.create(
+                post=self.post, author=self.reader, text=f'Спам {number}'
+            )
+        kept = Comment.objects.create(
+            post=self.post, author=self.author, text='Ответ'
+        )
+        # Не зависит от числа комментариев: публикации пересчитываются по
+        # разу, а не после каждого удалённого комментария.
+        with self.assertNumQueries(10):
+            self.reader.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertEqual(
+            [entry['id'] for entry in self.post.latest_comments], [kept.pk]
+        )
+
+    def test_comment_of_another_post(self):
+        for name in ('edit_comment', 'delete_comment'):
+            with self.assertNumQueries(3):
+                response = self.client.get(
+                    self.comment_url(name, post=self.scheduled_post)
+                )
+            self.assertEqual(response.status_code, 404)
+
+    def test_comment_of_another_user(self):
+        self.client.force_login(self.author)
+        for name in ('edit_comment', 'delete_comment'):
+            response = self.client.post(self.comment_url(name))
+            self.assertEqual(response.status_code, 404)
+
+
+class ProfileFeedTest(BlogTestCase):
+    """Профиль: автору — все публикации, остальным — опубликованные."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.reader = User.objects.create(username='reader')
+        location = Location.objects.create(name='Место')
+        cls.published = [
+            cls.create_post(title=f'Публикация {number}', location=location)
+            for number in range(5)
+        ]
+        cls.scheduled = cls.create_post(
+            title='Отложенная публикация',
+            pub_date=timezone.now() + timedelta(days=1),
+        )
+        cls.url = reverse(
+            'blog:profile', kwargs={'username': cls.author.username}
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_visitor_sees_published_posts(self):
+        for user in (None, self.reader):
+            if user is not None:
+                self.client.force_login(user)
+            response = self.client.get(self.url)
+            self.assertEqual(
+                response.context['page_obj'].paginator.count, 5
+            )
+            self.assertNotContains(response, self.scheduled.title)
+
+    def test_owner_sees_all_posts(self):
+        self.client.force_login(self.author)
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['page_obj'].paginator.count, 6)
+        self.assertContains(response, self.scheduled.title)
+
+    def test_page_queries(self):
+        # Пользователь, число публикаций, ближайшая отложенная публикация
+        # (срок кеша числа) и страница с категориями, местами и счётчиками.
+        with self.assertNumQueries(4):
+            self.client.get(self.url)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Планы запросов SQLite.')
+class CommentIndexPlanTest(TestCase):
+    """Выборки комментариев идут по составным индексам без сортировки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user')
+        cls.post = Post.objects.create(
+            title='Публикация',
+            text='Текст',
+            pub_date=timezone.now() - timedelta(days=1),
+            author=cls.user,
+        )
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(f'USING INDEX {index_name}', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_post_thread(self):
+        comments = self.post.comments.order_by('created_at', 'id')
+        self.assertUsesIndex(comments[:21], 'comment_post_thread_idx')
+        self.assertUsesIndex(
+            comments.filter(created_at__gte=timezone.now())[:21],
+            'comment_post_thread_idx',
+        )
+
+    def test_latest_post_comments(self):
+        self.assertUsesIndex(
+            self.post.comments.order_by('-created_at', '-id')[:20],
+            'comment_post_thread_idx',
+        )
+
+    def test_user_comments(self):
+        self.assertUsesIndex(
+            Comment.objects.filter(author=self.user).select_related(
+                'post'
+            ).order_by('-created_at', '-id')[:20],
+            'comment_author_idx',
+        )
+
+
+@override_settings(BLOG_IMAGE_MAX_UPLOAD_SIZE=1024 ** 2)
+class ImageUploadMemoryTest(BlogTestCase):
+    """Большие загрузки отклоняются, не занимая память целиком.
+
+    Тело запроса собирается до начала замера, поэтому пик tracemalloc —
+    это память, которую заняла обработка запроса. Буферы пикселей Pillow
+    выделяет вне Python, и tracemalloc их не видит, поэтому отдельно
+    проверяется, что изображение ни разу не раскодировано (``load``).
+    """
+
+    memory_limit = 4 * 1024 ** 2
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+    def post_image(self, content, name='image.png'):
+        image = BytesIO(content)
+        image.name = name
+        request = RequestFactory().post(reverse('blog:create_post'), {
+            'title': 'Публикация',
+            'text': 'Текст',
+            'pub_date': '2020-01-01T10:00',
+            'category': self.category.pk,
+            'image': image,
+        })
+        request.user = self.author
+        request._dont_enforce_csrf_checks = True
+        tracemalloc.start()
+        try:
+            with mock.patch.object(
+                ImageFile.ImageFile,
+                'load',
+                autospec=True,
+                side_effect=ImageFile.ImageFile.load,
+            ) as load:
+                response = PostCreateView.as_view()(request)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, self.memory_limit)
+        load.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Post.objects.exists())
+        return response.context_data['form'].errors['image']
+
+    def test_oversized_file(self):
+        errors = self.post_image(os.urandom(16 * 1024 ** 2))
+        self.assertIn('Файл больше 1,0\xa0МБ.', errors)
+
+    def test_decompression_bomb(self):
+        # 8000×8000: 64 мегапикселя, 192 МБ в RGB, но около 10 КБ в PNG.
+        bomb = BytesIO()
+        Image.new('1', (8000, 8000)).save(bomb, 'PNG')
+        errors = self.post_image(bomb.getvalue())
+        self.assertIn('Изображение больше 40 мегапикселей.', errors)
+
+
+class MediaServingTest(TestCase):
+    """Раздача загруженных файлов: кеширование, ETag и Range."""
+
+    content = bytes(range(256)) * 40
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = self.settings(MEDIA_ROOT=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        digest = hashlib.sha256(self.content).hexdigest()
+        self.name = f'post_images/{digest[:2]}/{digest}.png'
+        for name in (self.name, 'avatars/photo.png'):
+            path = os.path.join(directory.name, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(self.content)
+
+    def get(self, name, **headers):
+        return self.client.get(f'/media/{name}', **headers)
+
+    def test_content_addressed_file(self):
+        response = self.get(self.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(
+            response['Cache-Control'], 'public, max-age=31536000, immutable'
+        )
+        self.assertEqual(
+            response['ETag'], f'"{os.path.basename(self.name)}"'
+        )
+        response = self.get(
+            self.name, HTTP_IF_NONE_MATCH=f'W/{response["ETag"]}'
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_mutable_file(self):
+        response = self.get('avatars/photo.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        response = self.get(
+            'avatars/photo.png', HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_range(self):
+        for header, start, end in (
+            ('bytes=100-199', 100, 199),
+            ('bytes=10000-', 10000, len(self.content) - 1),
+            ('bytes=-24', len(self.content) - 24, len(self.content) - 1),
+            ('bytes=10200-99999', 10200, len(self.content) - 1),
+        ):
+            with self.subTest(header):
+                response = self.get(self.name, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(
+                    b''.join(response.streaming_content),
+                    self.content[start:end + 1],
+                )
+                self.assertEqual(
+                    response['Content-Range'],
+                    f'bytes {start}-{end}/{len(self.content)}',
+                )
+                self.assertEqual(
+                    response['Content-Length'], str(end - start + 1)
+                )
+
+    def test_range_not_satisfiable(self):
+        response = self.get(self.name, HTTP_RANGE='bytes=20000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(
+            response['Content-Range'], f'bytes */{len(self.content)}'
+        )
+
+    def test_stale_if_range(self):
+        response = self.get(
+            self.name, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(BLOG_MEDIA_ACCEL='x-accel-redirect')
+    def test_accel_redirect(self):
+        response = self.get(self.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response['X-Accel-Redirect'], f'/internal-media/{self.name}'
+        )
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response.content, b'')
+
+    def test_hidden_and_outside_files(self):
+        for name in ('post_images/.upload-x', '../settings.py', 'avatars'):
+            with self.subTest(name):
+                self.assertEqual(self.get(name).status_code, 404)
+
+
+@mock.patch.object(CommentAdmin, 'purge_chunk_size', 10)
+class CommentPurgeTest(TestCase):
+    """Массовое удаление комментариев из админки: больше одной пачки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='pass')
+        cls.spammer = User.objects.create(username='spammer')
+        cls.reader = User.objects.create(username='reader')
+        cls.posts = [
+            Post.objects.create(
+                title=f'Публикация {number}',
+                text='Текст',
+                pub_date=timezone.now() - timedelta(days=1),
+                author=cls.admin,
+            )
+            for number in range(2)
+        ]
+        for number in range(50):
+            Comment.objects.create(
+                post=cls.posts[number % 2], author=cls.spammer, text='Спам'
+            )
+        cls.kept = Comment.objects.create(
+            post=cls.posts[0], author=cls.reader, text='Комментарий'
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def run_action(self, action, comment):
+        return self.client.post(
+            reverse('admin:blog_comment_changelist'),
+            {'action': action, '_selected_action': [comment.pk]},
+        )
+
+    def test_purge_by_author(self):
+        comment = Comment.objects.filter(author=self.spammer).first()
+        self.run_action('purge_by_author', comment)
+        self.assertFalse(Comment.objects.filter(author=self.spammer).exists())
+        self.assertTrue(Comment.objects.filter(pk=self.kept.pk).exists())
+        counts = dict(Post.objects.values_list('pk', 'comment_count'))
+        self.assertEqual(
+            counts, {self.posts[0].pk: 1, self.posts[1].pk: 0}
+        )
+        self.posts[0].refresh_from_db()
+        self.assertEqual(
+            [entry['id'] for entry in self.posts[0].latest_comments],
+            [self.kept.pk],
+        )
+
+    def test_purge_by_post(self):
+        self.run_action('purge_by_post', self.kept)
+        self.assertFalse(self.posts[0].comments.exists())
+        self.assertEqual(self.posts[1].comments.count(), 25)
+
+    def test_post_is_read_only_on_change(self):
+        self.client.post(
+            reverse('admin:blog_comment_change', args=(self.kept.pk,)),
+            {
+                'text': 'Исправлено',
+                'post': self.posts[1].pk,
+                'author': self.reader.pk,
+            },
+        )
+        self.kept.refresh_from_db()
+        self.assertEqual(self.kept.text, 'Исправлено')
+        self.assertEqual(self.kept.post, self.posts[0])
+
+
+class PostDetailConditionalGetTest(BlogTestCase):
+    """Ответ 304 на странице публикации не читает комментарии."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.post = cls.create_post()
+        # Больше, чем помещается в снимок Post.latest_comments.
+        for number in range(30):
+            Comment.objects.create(
+                post=cls.post, author=cls.author, text=f'Комментарий {number}'
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.author)
+        self.url = reverse(
+            'blog:post_detail', kwargs={'post_id': self.post.pk}
+        )
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        # Сессия, пользователь и публикация.
+        with self.assertNumQueries(3) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(any(
+            'blog_comment' in query['sql']
+            for query in queries.captured_queries
+        ))
+
+    def test_new_login_changes_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.logout()
+        self.client.force_login(self.author)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_comments_rendered(self):
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.context['comments']), 20)
+        self.assertTrue(response.context['comments'].has_next())
+
+
+class CommentQueueTest(BlogTestCase):
+    """Очередь комментариев: время отправки, порядок и повторная обработка."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.post = cls.create_post()
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = self.settings(BLOG_COMMENT_QUEUE_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def enqueue(self, text='Комментарий'):
+        return comment_queue.enqueue_comment(
+            self.post.pk, self.author.pk, text
+        )
+
+    def test_queued_comment_keeps_its_time(self):
+        self.client.force_login(self.author)
+        self.client.post(
+            reverse('blog:add_comment', kwargs={'post_id': self.post.pk}),
+            {'text': 'Из очереди'},
+        )
+        self.assertFalse(Comment.objects.exists())
+        response = self.client.get(
+            reverse('blog:post_detail', kwargs={'post_id': self.post.pk})
+        )
+        [pending] = response.context['pending_comments']
+        self.assertEqual(comment_queue.drain(), (1, 0))
+        comment = Comment.objects.get()
+        self.assertEqual(comment.created_at, pending.created_at)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+    def test_thread_order(self):
+        self.enqueue('Раньше')
+        Comment.objects.create(
+            post=self.post, author=self.author, text='Позже'
+        )
+        comment_queue.drain()
+        self.assertEqual(
+            list(self.post.comments.values_list('text', flat=True)),
+            ['Раньше', 'Позже'],
+        )
+
+    def test_replay_skips_only_saved_entries(self):
+        self.enqueue()
+        self.enqueue()
+        names = comment_queue._claim(comment_queue._entries())
+        saved = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, saved)
+        for name in names:
+            shutil.copy(
+                comment_queue._path(comment_queue.PROCESSING_DIR, name), saved
+            )
+        # Одинаковый текст — не повтор: добавляются оба комментария.
+        self.assertEqual(comment_queue.process_batch(names), (2, 0))
+        # Сбой после фиксации: файлы остались в processing/.
+        for name in names:
+            shutil.copy(
+                os.path.join(saved, name),
+                comment_queue._path(comment_queue.PROCESSING_DIR),
+            )
+        self.enqueue()
+        comment_queue._claim(comment_queue._entries())
+        self.assertEqual(comment_queue.replay(), (1, 2))
+        self.assertEqual(self.post.comments.count(), 3)
+
+    def test_malformed_entry(self):
+        name = self.enqueue()
+        with open(comment_queue._path(name), 'w') as file:
+            file.write('{"post_id": "x"}')
+        self.assertEqual(comment_queue.drain(), (0, 0))
+        self.assertEqual(
+            comment_queue._entries(comment_queue.FAILED_DIR), [name]
+        )
+
+
+class CachedCountPaginatorTest(BlogTestCase):
+    """Общее количество публикаций ленты берётся из кеша."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for number in range(3):
+            cls.create_post(title=f'Публикация {number}')
+
+    def setUp(self):
+        cache.clear()
+
+    def count(self):
+        return CachedCountPaginator(
+            Post.objects.published(), 2, feed=FEED_INDEX
+        ).count
+
+    def test_count_is_cached_until_feed_changes(self):
+        self.assertEqual(self.count(), 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.count(), 3)
+        self.create_post(title='Публикация 3')
+        self.assertEqual(self.count(), 4)
+
+    @override_settings(BLOG_FEED_COUNT_ESTIMATE_THRESHOLD=1000)
+    def test_estimate_count(self):
+        # psycopg2 отдаёт EXPLAIN (FORMAT JSON) уже разобранным, другие
+        # драйверы — строкой; оценка ниже порога заменяется точным COUNT.
+        plan = [{'Plan': {'Plan Rows': 5000}}]
+        for row, expected in (
+            (plan, 5000),
+            (json.dumps(plan), 5000),
+            ([{'Plan': {'Plan Rows': 10}}], 3),
+        ):
+            with self.subTest(row=row):
+                cache.clear()
+                fake = mock.MagicMock(vendor='postgresql')
+                cursor = fake.cursor.return_value.__enter__.return_value
+                cursor.fetchone.return_value = (row,)
+                with mock.patch(
+                    'blog.paginators.connections', {'default': fake}
+                ):
+                    self.assertEqual(self.count(), expected)
+                sql = cursor.execute.call_args[0][0]
+                self.assertTrue(sql.startswith('EXPLAIN (FORMAT JSON) '))
+
+
+class LastModifiedTest(BlogTestCase):
+    """Время последнего изменения ленты: публикации, категории и места."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.location = Location.objects.create(name='Место')
+        cls.posts = [
+            cls.create_post(
+                title=f'Публикация {number}',
+                location=cls.location if number else None,
+            )
+            for number in range(2)
+        ]
+
+    def assert_last_modified(self, expected):
+        posts = Post.objects.published().for_feed()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_feed_last_modified(posts), expected)
+        loaded = list(posts)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_last_modified(loaded), expected)
+
+    def test_post_change(self):
+        post = self.posts[0]
+        post.text = 'Исправлено'
+        post.save()
+        self.assert_last_modified(post.updated_at)
+
+    def test_related_change(self):
+        for obj in (self.category, self.location):
+            with self.subTest(obj._meta.model_name):
+                obj.save()
+                self.assert_last_modified(obj.updated_at)
+
+    def test_empty_feed(self):
+        self.assertIsNone(get_feed_last_modified(Post.objects.none()))
+
+
+class CursorPaginatorTest(BlogTestCase):
+    """Постраничный вывод по ключу (pub_date, id), в том числе при равных
+    pub_date."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        now = timezone.now()
+        # По две публикации на каждое время: страницы режут пары пополам.
+        for number in range(7):
+            cls.create_post(
+                title=f'Публикация {number}',
+                pub_date=now - timedelta(days=number // 2),
+            )
+        cls.expected = list(
+            Post.objects.order_by('-pub_date', '-id')
+            .values_list('pk', flat=True)
+        )
+
+    def setUp(self):
+        self.paginator = CursorPaginator(Post.objects.all(), 3)
+
+    def pages_forward(self):
+        pages, cursor = [], None
+        while True:
+            page = self.paginator.get_page(cursor)
+            pages.append(page)
+            if not page.has_next():
+                return pages
+            cursor = page.next_cursor
+
+    def test_next_pages(self):
+        pages = self.pages_forward()
+        self.assertEqual(
+            [post.pk for page in pages for post in page], self.expected
+        )
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertFalse(pages[0].has_previous())
+        self.assertTrue(pages[-1].has_previous())
+
+    def test_previous_pages(self):
+        pages = self.pages_forward()
+        page = pages[-1]
+        for expected in reversed(pages[:-1]):
+            page = self.paginator.get_page(page.previous_cursor)
+            self.assertEqual(
+                [post.pk for post in page], [post.pk for post in expected]
+            )
+            self.assertTrue(page.has_next())
+        self.assertFalse(page.has_previous())
+
+    def test_invalid_cursor(self):
+        first = [post.pk for post in self.paginator.get_page(None)]
+        crafted = [
+            ['garbage', 1],
+            [timezone.now(), 'x'],
+            [[1], 2],
+            [{'dt': 'не-дата'}, 1],
+            [timezone.now(), 2 ** 70],
+        ]
+        for cursor in (
+            'не-курсор', 'e30', encode_cursor([1]),
+            *(encode_cursor(values) for values in crafted),
+        ):
+            with self.subTest(cursor=cursor):
+                page = self.paginator.get_page(cursor)
+                self.assertEqual([post.pk for post in page], first)
+                self.assertFalse(page.has_previous())
+
+    def test_crafted_cursor_in_views(self):
+        post = Post.objects.first()
+        Comment.objects.create(
+            text='Комментарий', post=post, author=post.author
+        )
+        cursor = encode_cursor(['garbage', [1]])
+        for url in (
+            reverse('blog:comments', args=(post.pk,)),
+            reverse('blog:profile_comments', args=(post.author.username,)),
+        ):
+            with self.subTest(url=url):
+                response = self.client.get(url, {'cursor': cursor})
+                self.assertEqual(response.status_code, 200)
+
+    def test_deep_page_runs_one_query(self):
+        cursor = self.pages_forward()[-2].next_cursor
+        with self.assertNumQueries(1) as queries:
+            page = self.paginator.get_page(cursor)
+        self.assertEqual(len(page), 1)
+        self.assertNotIn('COUNT(', queries.captured_queries[0]['sql'])
+
+    @mock.patch.object(PostListView, 'pagination_mode', 'cursor')
+    @mock.patch.object(PostListView, 'paginate_by', 3)
+    def test_feed_view(self):
+        cache.clear()
+        url = reverse('blog:index')
+        cursor = self.client.get(url).context['page_obj'].next_cursor
+        cursor = self.client.get(
+            url, {'cursor': cursor}
+        ).context['page_obj'].next_cursor
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'cursor': cursor})
+        self.assertEqual(
+            [post.pk for post in response.context['page_obj']],
+            self.expected[6:],
+        )
+        self.assertFalse(any(
+            'COUNT(' in query['sql'] for query in queries.captured_queries
+        ))
+
+
+class ContentAddressedImageTest(BlogTestCase):
+    """Общие файлы изображений удаляются вместе с последней ссылкой."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other = User.objects.create(username='other')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.media_root = directory.name
+        settings = self.settings(MEDIA_ROOT=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    @staticmethod
+    def image_content(color):
+        content = BytesIO()
+        Image.new('RGB', (400, 300), color).save(content, 'PNG')
+        return content.getvalue()
+
+    def create_post(self, content, author=None, name='photo.png'):
+        return Post.objects.create(
+            title='Публикация',
+            text='Текст',
+            pub_date=timezone.now(),
+            author=author or self.author,
+            image=SimpleUploadedFile(name, content),
+        )
+
+    def files(self):
+        # Без скрытых файлов: блокировок и меток повторной загрузки.
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media_root)
+            for root, _, names in os.walk(self.media_root)
+            for name in names
+            if not name.startswith('.')
+        )
+
+    def make_old(self):
+        """Состарить все файлы и метки на срок REUSE_GRACE."""
+        moment = time.time() - images.REUSE_GRACE - 1
+        for root, _, names in os.walk(self.media_root):
+            for name in names:
+                os.utime(os.path.join(root, name), (moment, moment))
+
+    def test_same_content_is_stored_once(self):
+        content = self.image_content('red')
+        first = self.create_post(content)
+        second = self.create_post(content, name='copy.png')
+        digest = hashlib.sha256(content).hexdigest()
+        expected = f'post_images/{digest[:2]}/{digest}.png'
+        self.assertEqual(first.image.name, expected)
+        self.assertEqual(second.image.name, expected)
+        self.assertEqual(self.files(), [expected])
+
+    def test_file_is_deleted_with_last_reference(self):
+        first = self.create_post(self.image_content('red'))
+        second = self.create_post(
+            self.image_content('red'), author=self.other
+        )
+        with first.image.open('rb') as file:
+            build_variants(file)
+        stored = self.files()
+        self.assertGreater(len(stored), 1)
+        # Удаление — не сразу после повторной загрузки того же файла.
+        self.make_old()
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(self.files(), stored)
+        # Каскадное удаление публикаций вместе с автором.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.delete()
+        self.assertFalse(Post.objects.filter(pk=second.pk).exists())
+        self.assertEqual(self.files(), [])
+
+    def test_replaced_file_is_deleted(self):
+        post = self.create_post(self.image_content('red'))
+        kept = self.create_post(self.image_content('blue'))
+        old_name = post.image.name
+        post.image = SimpleUploadedFile('new.png', self.image_content('blue'))
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+        self.assertEqual(post.image.name, kept.image.name)
+        self.assertEqual(self.files(), [kept.image.name])
+        self.assertNotIn(old_name, self.files())
+
+    def jpeg_content(self):
+        content = BytesIO()
+        Image.new('RGB', (400, 300), 'red').save(content, 'JPEG')
+        return content.getvalue()
+
+    def test_extension_follows_format(self):
+        content = self.jpeg_content()
+        first = self.create_post(content, name='a.jpeg')
+        second = self.create_post(content, name='b.JPG')
+        self.assertTrue(first.image.name.endswith('.jpg'))
+        self.assertEqual(first.image.name, second.image.name)
+
+    def test_shared_variants_outlive_other_names(self):
+        # Файл с тем же содержимым под старым именем (загружен до того,
+        # как расширение стало зависеть от формата).
+        content = self.jpeg_content()
+        current = self.create_post(content)
+        legacy_name = current.image.name.replace('.jpg', '.jpeg')
+        with open(os.path.join(self.media_root, legacy_name), 'wb') as file:
+            file.write(content)
+        legacy = self.create_post(self.image_content('blue'))
+        Post.objects.filter(pk=legacy.pk).update(image=legacy_name)
+        with current.image.open('rb') as file:
+            variants = build_variants(file)
+        self.make_old()
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.get(pk=legacy.pk).delete()
+        self.assertNotIn(legacy_name, self.files())
+        self.assertTrue(default_storage.exists(
+            variants['card']['jpeg'][0]['name']
+        ))
+
+    def test_reused_file_is_not_deleted(self):
+        content = self.image_content('red')
+        post = self.create_post(content)
+        self.make_old()
+        # Другая публикация загружает то же содержимое, но ещё не
+        # сохранена, когда удаляется последняя ссылка на файл.
+        name = post_image_storage.save(
+            'post_images/copy.png', ContentFile(content)
+        )
+        self.assertEqual(name, post.image.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        self.assertEqual(self.files(), [name])
+
+    def test_delete_unused_images_command(self):
+        self.create_post(self.image_content('red'))
+        orphan = post_image_storage.save(
+            'post_images/orphan.png', ContentFile(self.image_content('blue'))
+        )
+        call_command('delete_unused_images', stdout=StringIO())
+        # Только что загруженный файл может ещё ждать своей публикации.
+        self.assertIn(orphan, self.files())
+        self.make_old()
+        call_command('delete_unused_images', stdout=StringIO())
+        self.assertNotIn(orphan, self.files())
+        self.assertEqual(len(self.files()), 1)
+
+
+class FeedQueryCountTest(BlogTestCase):
+    """Число запросов страниц лент не зависит от числа карточек."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.reader = User.objects.create(username='reader')
+        location = Location.objects.create(name='Место')
+        for number in range(12):
+            post = cls.create_post(
+                title=f'Публикация {number}', location=location
+            )
+            for _ in range(number % 3):
+                Comment.objects.create(
+                    post=post, author=cls.author, text='Комментарий'
+                )
+        cls.urls = (
+            reverse('blog:index'),
+            reverse('blog:category_posts', args=['category']),
+            reverse('blog:profile', args=['author']),
+        )
+
+    def count_queries(self, url, page_size):
+        cache.clear()
+        with mock.patch.object(FeedPaginationMixin, 'paginate_by', page_size):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_comment_counts_do_not_add_queries(self):
+        for url in self.urls:
+            with self.subTest(url):
+                small, _ = self.count_queries(url, 2)
+                large, response = self.count_queries(url, 10)
+                self.assertEqual(small, large)
+                self.assertContains(response, 'Комментарии (2)')
+                self.assertContains(response, 'Комментарии (0)')
+
+    def test_listing_pages(self):
+        # Общее количество записей ленты, ближайшая отложенная публикация
+        # и сама страница; у категории и профиля ещё их объект. Повторный
+        # запрос берёт из кеша количество, время публикации и категорию.
+        for url, cold, warm in zip(self.urls, (3, 4, 4), (1, 1, 2)):
+            with self.subTest(url):
+                cache.clear()
+                with self.assertNumQueries(cold):
+                    self.client.get(url)
+                # Вторая страница: её нет в кеше страниц для анонимов.
+                with self.assertNumQueries(warm):
+                    self.client.get(url, {'page': 2})
+                self.client.force_login(self.reader)
+                # Плюс сессия и пользователь.
+                with self.assertNumQueries(warm + 2):
+                    self.client.get(url)
+                self.client.logout()
+
+
+class PostCardCacheTest(BlogTestCase):
+    """Карточки публикаций отрисовываются один раз до изменения данных."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.location = Location.objects.create(name='Место')
+        cls.posts = [
+            cls.create_post(
+                title=f'Публикация {number}',
+                location=cls.location,
+            )
+            for number in range(2)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def render(self):
+        """Карточки ленты и число карточек, отрисованных заново."""
+        posts = Post.objects.published().for_feed().order_by('pk')
+        with mock.patch(
+            'blog.cache.render_to_string', wraps=render_to_string
+        ) as render:
+            cards = render_post_cards(posts)
+        return cards, render.call_count
+
+    def test_cards_are_cached(self):
+        self.assertEqual(self.render()[1], 2)
+        self.assertEqual(self.render()[1], 0)
+
+    def test_cards_are_shared_between_pages(self):
+        self.client.get(reverse('blog:index'))
+        with mock.patch(
+            'blog.cache.render_to_string', wraps=render_to_string
+        ) as render:
+            for url in (
+                reverse('blog:category_posts', args=['category']),
+                reverse('blog:profile', args=['author']),
+            ):
+                self.client.get(url)
+        self.assertEqual(render.call_count, 0)
+
+    def test_invalidation(self):
+        changes = (
+            ('post', lambda: Post.objects.filter(
+                pk=self.posts[0].pk
+            ).get().save(), 1),
+            ('category', self.category.save, 2),
+            ('location', self.location.save, 2),
+            ('author', self.author.save, 2),
+            ('comment', lambda: Comment.objects.create(
+                post=self.posts[1], author=self.author, text='Комментарий'
+            ), 1),
+        )
+        self.render()
+        for name, change, rendered in changes:
+            with self.subTest(name):
+                change()
+                self.assertEqual(self.render()[1], rendered)
+
+    def test_changed_values_are_shown(self):
+        self.render()
+        self.location.name = 'Другое место'
+        self.location.save()
+        self.author.username = 'renamed'
+        self.author.save()
+        Comment.objects.create(
+            post=self.posts[0], author=self.author, text='Комментарий'
+        )
+        cards, _ = self.render()
+        self.assertIn('Другое место', cards[0])
+        self.assertIn('@renamed', cards[0])
+        self.assertIn('Комментарии (1)', cards[0])
+
+
+class AnonymousPageCacheTest(BlogTestCase):
+    """Кеш страниц для анонимов: попадания, обход и точный сброс."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.post = cls.create_post()
+        cls.urls = (
+            reverse('blog:index'),
+            reverse('blog:category_posts', args=['category']),
+            reverse('blog:post_detail', args=[cls.post.pk]),
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_hit_runs_no_queries(self):
+        for url in self.urls:
+            with self.subTest(url):
+                content = self.client.get(url).content
+                with self.assertNumQueries(0):
+                    response = self.client.get(url)
+                self.assertEqual(response.content, content)
+
+    def test_authenticated_users_bypass_cache(self):
+        url = reverse('blog:post_detail', args=[self.post.pk])
+        self.client.get(url)
+        self.client.force_login(self.author)
+        response = self.client.get(url)
+        self.assertContains(response, 'id="id_text"')
+
+    def test_writes_invalidate_pages(self):
+        for url in self.urls:
+            self.client.get(url)
+        self.post.title = 'Новый заголовок'
+        self.post.save()
+        for url in self.urls:
+            with self.subTest(url):
+                self.assertContains(self.client.get(url), 'Новый заголовок')
+        Comment.objects.create(
+            post=self.post, author=self.author, text='Новый комментарий'
+        )
+        self.assertContains(self.client.get(self.urls[2]), 'Новый комментарий')
+        self.category.title = 'Новая категория'
+        self.category.save()
+        for url in self.urls[:2]:
+            with self.subTest(url):
+                self.assertContains(self.client.get(url), 'Новая категория')
+
+    def test_scheduled_post_appears_on_time(self):
+        now = timezone.now()
+        self.create_post(
+            title='Отложенная публикация', pub_date=now + timedelta(minutes=1)
+        )
+        for url in self.urls[:2]:
+            self.assertNotContains(
+                self.client.get(url), 'Отложенная публикация'
+            )
+        # Через две минуты: записи кеша, срок которых ограничен временем
+        # публикации, истекли, и публикация видна.
+        later = time.time() + 120
+        with mock.patch('time.time', return_value=later), mock.patch(
+            'django.utils.timezone.now', return_value=now + timedelta(
+                minutes=2
+            )
+        ):
+            for url in self.urls[:2]:
+                with self.subTest(url):
+                    self.assertContains(
+                        self.client.get(url), 'Отложенная публикация'
+                    )
+
+
+class SharedCacheCheckTest(SimpleTestCase):
+    """Проверка blog.W001: кеш версий должен быть общим для процессов."""
+
+    def test_shared_cache(self):
+        self.assertEqual(check_shared_cache(None), [])
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }})
+    def test_process_local_cache(self):
+        self.assertEqual(
+            [warning.id for warning in check_shared_cache(None)],
+            ['blog.W001'],
+        )
+
+
+@mock.patch.object(PostDetailView, 'stream_comments', True)
+@mock.patch.object(PostDetailView, 'comments_chunk_size', 2)
+class StreamingPostDetailTest(BlogTestCase):
+    """Потоковая страница публикации: сначала публикация, потом ветка."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.post = cls.create_post()
+        for number in range(5):
+            Comment.objects.create(
+                post=cls.post, author=cls.author, text=f'Комментарий {number}'
+            )
+
+    def test_stream(self):
+        self.client.force_login(self.author)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('blog:post_detail', args=[self.post.pk])
+            )
+            self.assertTrue(response.streaming)
+            self.assertFalse(any(
+                'blog_comment' in query['sql']
+                for query in queries.captured_queries
+            ))
+            chunks = [
+                chunk.decode() for chunk in response.streaming_content
+            ]
+        head, *comments, tail = chunks
+        self.assertIn('Публикация', head)
+        self.assertNotIn('Комментарий 0', head)
+        # Пять комментариев пачками по два.
+        self.assertEqual(
+            [chunk.count('Комментарий ') for chunk in comments if chunk],
+            [2, 2, 1],
+        )
+        page = ''.join(chunks)
+        positions = [page.index(f'Комментарий {n}') for n in range(5)]
+        self.assertEqual(positions, sorted(positions))
+        self.assertIn('</html>', tail)
+        # Список комментариев в контекст шаблона не загружается.
+        self.assertNotIn('comments', response.context)
+
+
+class ProfileCommentsTest(BlogTestCase):
+    """Вкладка комментариев профиля: видимость, курсоры и один запрос."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.reader = User.objects.create(username='reader')
+        hidden_category = Category.objects.create(
+            title='Скрытая',
+            description='Описание',
+            slug='hidden',
+            is_published=False,
+        )
+        yesterday = timezone.now() - timedelta(days=1)
+        cls.post = cls.create_post(pub_date=yesterday)
+        hidden_posts = [
+            cls.create_post(
+                title='Черновик',
+                pub_date=yesterday,
+                is_published=False,
+            ),
+            cls.create_post(
+                title='Отложенная',
+                pub_date=timezone.now() + timedelta(days=1),
+            ),
+            cls.create_post(
+                title='В скрытой категории',
+                pub_date=yesterday,
+                category=hidden_category,
+            ),
+        ]
+        for number in range(25):
+            Comment.objects.create(
+                post=cls.post,
+                author=cls.reader,
+                text=f'Комментарий {number}',
+                created_at=yesterday + timedelta(minutes=number),
+            )
+        for post in hidden_posts:
+            Comment.objects.create(
+                post=post, author=cls.reader, text=f'К «{post.title}»'
+            )
+        cls.url = reverse('blog:profile_comments', args=('reader',))
+
+    def setUp(self):
+        cache.clear()
+
+    def get_texts(self, response):
+        return [comment.text for comment in response.context['page_obj']]
+
+    def test_hidden_posts(self):
+        response = self.client.get(self.url)
+        self.assertFalse(any(
+            text.startswith('К «') for text in self.get_texts(response)
+        ))
+        self.client.force_login(self.reader)
+        response = self.client.get(self.url)
+        self.assertFalse(any(
+            text.startswith('К «') for text in self.get_texts(response)
+        ))
+
+    def test_author_sees_comments_on_own_hidden_posts(self):
+        self.client.force_login(self.author)
+        texts = self.get_texts(self.client.get(self.url))
+        self.assertEqual(
+            texts[:3],
+            [
+                'К «В скрытой категории»',
+                'К «Отложенная»',
+                'К «Черновик»',
+            ],
+        )
+
+    def test_cursor_pages(self):
+        response = self.client.get(self.url)
+        page = response.context['page_obj']
+        self.assertEqual(
+            self.get_texts(response),
+            [f'Комментарий {number}' for number in range(24, 4, -1)],
+        )
+        self.assertFalse(page.has_previous())
+        response = self.client.get(self.url, {'cursor': page.next_cursor})
+        self.assertEqual(
+            self.get_texts(response),
+            [f'Комментарий {number}' for number in range(4, -1, -1)],
+        )
+        self.assertFalse(response.context['page_obj'].has_next())
+        response = self.client.get(
+            self.url, {'cursor': response.context['page_obj'].previous_cursor}
+        )
+        self.assertEqual(
+            self.get_texts(response)[0], 'Комментарий 24'
+        )
+
+    def test_post_titles_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertContains(response, 'Публикация')
+        comment_queries = [
+            query['sql'] for query in queries.captured_queries
+            if 'blog_comment' in query['sql']
+        ]
+        self.assertEqual(len(comment_queries), 1)
+        self.assertIn('JOIN "blog_post"', comment_queries[0])
+        self.assertFalse(any(
+            query['sql'].startswith('SELECT "blog_post"')
+            for query in queries.captured_queries
+        ))
+
+
+class CommentListViewTest(BlogTestCase):
+    """Следующие страницы комментариев: HTML-фрагмент и JSON."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.post = cls.create_post()
+        cls.scheduled_post = cls.create_post(
+            title='Отложенная публикация',
+            pub_date=timezone.now() + timedelta(days=1),
+        )
+        start = timezone.now() - timedelta(hours=1)
+        for number in range(45):
+            Comment.objects.create(
+                post=cls.post,
+                author=cls.author,
+                text=f'Комментарий {number}',
+                created_at=start + timedelta(seconds=number),
+            )
+        cls.url = reverse('blog:comments', args=(cls.post.pk,))
+
+    def test_html(self):
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.context['comments']), 20)
+        self.assertContains(response, 'Комментарий 19')
+        self.assertNotContains(response, 'Комментарий 20')
+        self.assertNotContains(response, '<html')
+
+    def test_json(self):
+        data = self.client.get(self.url, {'format': 'json'}).json()
+        self.assertEqual(
+            [comment['text'] for comment in data['comments']],
+            [f'Комментарий {number}' for number in range(20)],
+        )
+        self.assertEqual(data['comments'][0]['author'], 'author')
+        self.assertIn('Комментарий 0', data['html'])
+        self.assertIsNotNone(data['next_cursor'])
+
+    def test_follow_next_cursor(self):
+        texts, cursor, pages = [], None, 0
+        while True:
+            params = {'format': 'json'}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.client.get(self.url, params).json()
+            texts += [comment['text'] for comment in data['comments']]
+            pages += 1
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(pages, 3)
+        self.assertEqual(
+            texts, [f'Комментарий {number}' for number in range(45)]
+        )
+
+    def test_hidden_post(self):
+        url = reverse('blog:comments', args=(self.scheduled_post.pk,))
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(self.author)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class CategoryHeaderCacheTest(BlogTestCase):
+    """Категория страницы категории из кеша и её сброс сигналами."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.post = cls.create_post()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cache_hit(self):
+        self.assertEqual(get_published_category('category'), self.category)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                get_published_category('category'), self.category
+            )
+
+    def test_missing_category_is_cached(self):
+        self.assertIsNone(get_published_category('missing'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_published_category('missing'))
+
+    def test_save_invalidates(self):
+        get_published_category('category')
+        self.category.title = 'Новое название'
+        self.category.save()
+        self.assertEqual(
+            get_published_category('category').title, 'Новое название'
+        )
+
+    def test_slug_rename(self):
+        get_published_category('category')
+        get_published_category('renamed')
+        category = Category.objects.get(pk=self.category.pk)
+        category.slug = 'renamed'
+        category.save()
+        self.assertIsNone(get_published_category('category'))
+        self.assertEqual(get_published_category('renamed'), self.category)
+
+    def test_unpublish(self):
+        url = reverse('blog:category_posts', args=('category',))
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.category.is_published = False
+        self.category.save()
+        self.assertIsNone(get_published_category('category'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_feed_query_does_not_join_category(self):
+        url = reverse('blog:category_posts', args=('category',))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, 'Публикация')
+        post_queries = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('SELECT "blog_post"')
+        ]
+        self.assertEqual(len(post_queries), 1)
+        self.assertNotIn('blog_category', post_queries[0])
+
+
+class LatestCommentsSnapshotTest(BlogTestCase):
+    """Ветка публикации из снимка Post.latest_comments, пока он полон."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.post = cls.create_post()
+        cls.comments = [
+            Comment.objects.create(
+                post=cls.post, author=cls.author, text=f'Комментарий {number}'
+            )
+            for number in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.author)
+        self.url = reverse('blog:post_detail', args=[self.post.pk])
+
+    def get_thread(self):
+        """Тексты комментариев страницы и были ли запросы к комментариям."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+            texts = [comment.text for comment in response.context['comments']]
+        queried = any(
+            'blog_comment' in query['sql']
+            for query in queries.captured_queries
+        )
+        return texts, queried
+
+    def test_snapshot_is_used(self):
+        self.assertEqual(
+            self.get_thread(),
+            (['Комментарий 0', 'Комментарий 1', 'Комментарий 2'], False),
+        )
+
+    def test_snapshot_follows_writes(self):
+        comment = self.comments[1]
+        comment.text = 'Исправлено'
+        comment.save()
+        self.comments[0].delete()
+        self.author.username = 'renamed'
+        self.author.save()
+        texts, queried = self.get_thread()
+        self.assertEqual(texts, ['Исправлено', 'Комментарий 2'])
+        self.assertFalse(queried)
+        self.post.refresh_from_db()
+        self.assertEqual(
+            {entry['author'] for entry in self.post.latest_comments},
+            {'renamed'},
+        )
+
+    def test_long_thread_is_queried(self):
+        for number in range(3, 25):
+            Comment.objects.create(
+                post=self.post,
+                author=self.author,
+                text=f'Комментарий {number}',
+            )
+        texts, queried = self.get_thread()
+        self.assertTrue(queried)
+        self.assertEqual(
+            texts, [f'Комментарий {number}' for number in range(20)]
+        )
+
+
+class ImageVariantsTest(BlogTestCase):
+    """Уменьшенные копии изображений: размеры, форматы и разметка."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = self.settings(MEDIA_ROOT=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    @staticmethod
+    def image_file(size, **save_kwargs):
+        file = BytesIO()
+        Image.new('RGB', size, 'red').save(file, 'JPEG', **save_kwargs)
+        file.seek(0)
+        return file
+
+    def sizes(self, variants, name, fmt):
+        return [
+            (entry['width'], entry['height'])
+            for entry in variants[name][fmt]
+        ]
+
+    def test_build_variants(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Поворот на 90°: 2000×1000 становится 1000×2000.
+        exif[0x010E] = 'Описание с камеры'
+        variants = build_variants(self.image_file((2000, 1000), exif=exif))
+        self.assertEqual(
+            (variants['width'], variants['height']), (1000, 2000)
+        )
+        for fmt, image_format in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+            with self.subTest(fmt):
+                self.assertEqual(
+                    self.sizes(variants, 'card', fmt), [(320, 180), (640, 360)]
+                )
+                self.assertEqual(
+                    self.sizes(variants, 'detail', fmt), [(640, 1280)]
+                )
+                for entry in variants['card'][fmt] + variants['detail'][fmt]:
+                    with default_storage.open(entry['name']) as file:
+                        image = Image.open(file)
+                        self.assertEqual(image.format, image_format)
+                        self.assertEqual(
+                            image.size, (entry['width'], entry['height'])
+                        )
+                        self.assertEqual(len(image.getexif()), 0)
+                        self.assertNotIn('icc_profile', image.info)
+
+    def test_small_image_is_not_enlarged(self):
+        variants = build_variants(self.image_file((200, 100)))
+        self.assertEqual(self.sizes(variants, 'card', 'jpeg'), [(200, 112)])
+        self.assertEqual(self.sizes(variants, 'detail', 'jpeg'), [(200, 100)])
+
+    def create_post(self):
+        return Post.objects.create(
+            title='Публикация',
+            text='Текст',
+            pub_date=timezone.now(),
+            author=self.author,
+            image=SimpleUploadedFile(
+                'photo.jpg', self.image_file((1600, 900)).getvalue()
+            ),
+        )
+
+    def render_image(self, post):
+        return Template(
+            '{% load blog_tags %}{% post_image post "card" "40rem" %}'
+        ).render(Context({'post': post}))
+
+    def test_post_image_tag(self):
+        post = self.create_post()
+        self.assertIn(f'src="{post.image.url}"', self.render_image(post))
+        call_command('generate_image_variants', stdout=StringIO())
+        post.refresh_from_db()
+        html = self.render_image(post)
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('320w', html)
+        self.assertIn('1280w', html)
+        self.assertIn('width="1280" height="720"', html)
+        self.assertIn('sizes="40rem"', html)
+
+    def test_command_enqueue(self):
+        post = self.create_post()
+        call_command('generate_image_variants', '--enqueue', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants, {})
+        self.assertEqual(
+            list(ImageJob.objects.values_list('post_id', 'image')),
+            [(post.pk, post.image.name)],
+        )
+
+
+# Пул потоков вместо пула процессов: render_variants работает только с
+# файлами, а задания остаются в той же тестовой базе.
+@mock.patch('blog.image_jobs.ProcessPoolExecutor', ThreadPoolExecutor)
+class ImageJobTest(BlogTestCase):
+    """Задания построения вариантов: выполнение, повторы и устаревание."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = self.settings(MEDIA_ROOT=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    @staticmethod
+    def upload(color='red'):
+        file = BytesIO()
+        Image.new('RGB', (800, 600), color).save(file, 'PNG')
+        return SimpleUploadedFile('photo.png', file.getvalue())
+
+    def save_form(self, post=None, color='red'):
+        form = PostForm(
+            {
+                'title': 'Публикация',
+                'text': 'Текст',
+                'pub_date': '2020-01-01T10:00',
+                'category': self.category.pk,
+            },
+            {'image': self.upload(color)},
+            instance=post or Post(author=self.author),
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        return form.save()
+
+    def test_form_enqueues_and_job_completes(self):
+        post = self.save_form()
+        job = ImageJob.objects.get()
+        self.assertEqual(
+            (job.post_id, job.image, job.status),
+            (post.pk, post.image.name, ImageJob.PENDING),
+        )
+        self.assertEqual(image_jobs.process(10), (1, 0))
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants['width'], 800)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImageJob.DONE)
+        # Новое изображение сбрасывает варианты до следующего задания.
+        self.save_form(post, color='blue')
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants, {})
+        self.assertEqual(ImageJob.objects.filter(
+            status=ImageJob.PENDING
+        ).count(), 1)
+
+    def test_obsolete_job_is_skipped(self):
+        post = self.save_form()
+        self.save_form(post, color='blue')
+        old, new = ImageJob.objects.order_by('pk')
+        with mock.patch(
+            'blog.image_jobs.render_variants',
+            wraps=image_jobs.render_variants,
+        ) as render:
+            self.assertEqual(image_jobs.process(10), (1, 0))
+        render.assert_called_once_with(new.image)
+        old.refresh_from_db()
+        self.assertEqual(old.status, ImageJob.DONE)
+        post.refresh_from_db()
+        digest = os.path.splitext(os.path.basename(new.image))[0]
+        self.assertTrue(
+            post.image_variants['card']['jpeg'][0]['name'].startswith(
+                f'post_images/variants/{digest[:2]}/{digest}-'
+            )
+        )
+
+    def test_failed_job_is_retried(self):
+        self.save_form()
+        job = ImageJob.objects.get()
+        with mock.patch(
+            'blog.image_jobs.build_variants', side_effect=OSError('сбой')
+        ):
+            for attempt in range(1, image_jobs.MAX_ATTEMPTS + 1):
+                self.assertEqual(image_jobs.process(10), (0, 1))
+                job.refresh_from_db()
+                self.assertEqual(job.attempts, attempt)
+                self.assertIn('OSError: сбой', job.last_error)
+                if attempt < image_jobs.MAX_ATTEMPTS:
+                    self.assertEqual(job.status, ImageJob.PENDING)
+                    # Пауза растёт вдвое; до её конца задание не берётся.
+                    self.assertEqual(
+                        job.run_after - job.updated_at,
+                        image_jobs.RETRY_DELAY * 2 ** (attempt - 1),
+                    )
+                    self.assertEqual(image_jobs.process(10), (0, 0))
+                    ImageJob.objects.update(run_after=timezone.now())
+        self.assertEqual(job.status, ImageJob.FAILED)
+        self.assertEqual(image_jobs.retry_failed(), 1)
+        self.assertEqual(image_jobs.process(10), (1, 0))
+
+    def test_stale_job_is_recovered(self):
+        self.save_form()
+        ImageJob.objects.update(
+            status=ImageJob.RUNNING,
+            updated_at=timezone.now() - image_jobs.STALE_AFTER * 2,
+        )
+        self.assertEqual(image_jobs.recover_stale(), 1)
+        self.assertEqual(image_jobs.process(10), (1, 0))
@@ -0,0 +1,141 @@
+"""Приём изображений публикаций без лишней памяти.
+
+``CappedUploadHandler`` пишет загрузку сразу во временный файл кусками
+и отбрасывает файл, как только он превысил
+``BLOG_IMAGE_MAX_UPLOAD_SIZE``. ``ImageUploadField`` проверяет формат и
+размеры по заголовку, не раскодируя изображение, так что картинка в
+десятки мегапикселей отклоняется до того, как займёт память.
+"""
+import warnings
+from io import BytesIO
+
+from django import forms
+from django.conf import settings
+from django.core.files.uploadhandler import (
+    SkipFile, TemporaryFileUploadHandler,
+)
+from django.template.defaultfilters import filesizeformat
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from PIL import Image
+
+ALLOWED_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+
+def get_max_upload_size():
+    return getattr(settings, 'BLOG_IMAGE_MAX_UPLOAD_SIZE', 10 * 1024 ** 2)
+
+
+def get_max_pixels():
+    return getattr(settings, 'BLOG_IMAGE_MAX_PIXELS', 40 * 10 ** 6)
+
+
+class CappedUploadHandler(TemporaryFileUploadHandler):
+    """Загрузка во временный файл с ограничением размера каждого файла.
+
+    Отброшенные файлы записываются в ``request.rejected_uploads``
+    (имя поля → сообщение), чтобы форма могла показать ошибку.
+    """
+
+    def __init__(self, request=None, max_size=None):
+        super().__init__(request)
+        self.max_size = max_size or get_max_upload_size()
+        if request is not None and not hasattr(request, 'rejected_uploads'):
+            request.rejected_uploads = {}
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        self.received = 0
+        if self.content_length and self.content_length > self.max_size:
+            self.reject()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            self.reject()
+        return super().receive_data_chunk(raw_data, start)
+
+    def reject(self):
+        self.file.close()
+        if self.request is not None:
+            self.request.rejected_uploads[self.field_name] = (
+                f'Файл больше {filesizeformat(self.max_size)}.'
+            )
+        raise SkipFile()
+
+
+class CappedUploadMixin:
+    """Подключает CappedUploadHandler к представлению с формой.
+
+    Обработчики загрузки нужно заменить до разбора тела запроса, а его
+    разбирает уже CsrfViewMiddleware. Поэтому проверка CSRF отключается
+    для всего представления и выполняется заново после замены.
+    """
+
+    upload_handler_class = CappedUploadHandler
+
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        request.upload_handlers = [self.upload_handler_class(request)]
+        return csrf_protect(super().dispatch)(request, *args, **kwargs)
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['rejected_uploads'] = getattr(
+            self.request, 'rejected_uploads', {}
+        )
+        return kwargs
+
+
+class ImageUploadField(forms.ImageField):
+    """ImageField, который читает только заголовок изображения.
+
+    Формат и размеры проверяются до ``verify()``; изображение целиком не
+    раскодируется ни здесь, ни в стандартной проверке.
+    """
+
+    default_error_messages = {
+        'too_many_pixels': 'Изображение больше %(limit)s мегапикселей.',
+    }
+
+    def to_python(self, data):
+        f = forms.FileField.to_python(self, data)
+        if f is None:
+            return None
+        if hasattr(data, 'temporary_file_path'):
+            file = data.temporary_file_path()
+        elif hasattr(data, 'read'):
+            file = BytesIO(data.read())
+        else:
+            file = BytesIO(data['content'])
+        f.image = self.check_image(file)
+        f.content_type = Image.MIME.get(f.image.format)
+        if hasattr(f, 'seek') and callable(f.seek):
+            f.seek(0)
+        return f
+
+    def check_image(self, file):
+        too_many_pixels = forms.ValidationError(
+            self.error_messages['too_many_pixels'],
+            code='too_many_pixels',
+            params={'limit': get_max_pixels() // 10 ** 6},
+        )
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('error', Image.DecompressionBombWarning)
+                with Image.open(file) as image:
+                    if image.format not in ALLOWED_FORMATS:
+                        raise ValueError(image.format)
+                    width, height = image.size
+                    if width * height > get_max_pixels():
+                        raise too_many_pixels
+                    image.verify()
+                    return image
+        except forms.ValidationError:
+            raise
+        except (Image.DecompressionBombWarning, Image.DecompressionBombError):
+            raise too_many_pixels
+        except Exception as exc:
+            raise forms.ValidationError(
+                self.error_messages['invalid_image'], code='invalid_image',
+            ) from exc
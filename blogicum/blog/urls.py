@@ -15,6 +15,11 @@ urlpatterns = [
         views.PostDetailView.as_view(),
         name='post_detail'
     ),
+    path(
+        'posts/<int:post_id>/comments/',
+        views.CommentListView.as_view(),
+        name='comments',
+    ),
     path(
         'category/<slug:category_slug>/',
         views.CategoryDetailView.as_view(),
@@ -30,6 +35,11 @@ urlpatterns = [
         views.ProfileDetailView.as_view(),
         name='profile',
     ),
+    path(
+        'profile/<slug:username>/comments/',
+        views.ProfileCommentsView.as_view(),
+        name='profile_comments',
+    ),
     path(
         'posts/create/',
         views.PostCreateView.as_view(),
@@ -1,10 +1,180 @@
+from django.db import models
+from django.db.models import Count, Max, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Substr
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+# Карточке в ленте нужны только первые слова текста (truncatewords:10).
+FEED_TEXT_PREVIEW_LENGTH = 500
+
+# Сколько последних комментариев хранится в Post.latest_comments.
+LATEST_COMMENTS_SIZE = 20
+
+
+def published_q(prefix='', category=True):
+    """Условие «публикация видна всем»; prefix — путь к публикации.
+
+    ``category=False`` не проверяет категорию (и не присоединяет её
+    таблицу) — когда вызывающий код уже знает, что она опубликована.
+    """
+    condition = models.Q(**{
+        f'{prefix}is_published': True,
+        f'{prefix}pub_date__lt': timezone.now(),
+    })
+    if category:
+        condition &= models.Q(**{f'{prefix}category__is_published': True})
+    return condition
+
+
+def visible_q(user, prefix=''):
+    if not user.is_authenticated:
+        return published_q(prefix)
+    return published_q(prefix) | models.Q(**{f'{prefix}author': user})
+
+
+class PostQuerySet(models.QuerySet):
+
+    def published(self, category=True):
+        return self.filter(published_q(category=category))
+
+    def visible_to(self, user):
+        """Опубликованные и, для автора, все его собственные публикации."""
+        return self.filter(visible_q(user))
+
+    def scheduled(self):
+        """Отложенные публикации, которые ещё появятся в ленте."""
+        return self.filter(
+            is_published=True,
+            pub_date__gte=timezone.now(),
+            category__is_published=True,
+        )
+
+    def for_feed(self, category=True):
+        """Всё, что нужно карточке публикации, за один запрос.
+
+        ``category=False`` — категорию не присоединять: у выборки через
+        ``category.category`` она и так подставляется в каждую публикацию.
+        """
+        related = ('author', 'category', 'location')
+        if not category:
+            related = ('author', 'location')
+        return self.select_related(*related).annotate(
+            text_preview=Substr('text', 1, FEED_TEXT_PREVIEW_LENGTH),
+        ).defer('text', 'latest_comments')
 
 
 def get_published_posts(queryset):
-    new_queryset = queryset.filter(
-        is_published=True,
-        pub_date__lt=timezone.now(),
-        category__is_published=True,
+    return queryset.published()
+
+
+def get_next_publication_time(queryset):
+    """Когда в ленте появится ближайшая отложенная публикация."""
+    return queryset.scheduled().aggregate(
+        next_pub_date=Min('pub_date')
+    )['next_pub_date']
+
+
+def get_last_modified(posts):
+    """Последнее изменение уже загруженных публикаций, их категорий и мест.
+
+    Запросов не делает: связанные объекты должны прийти через
+    select_related, как в ``PostQuerySet.for_feed``.
+    """
+    return max(
+        (
+            obj.updated_at
+            for post in posts
+            for obj in (post, post.category, post.location)
+            if obj is not None
+        ),
+        default=None,
+    )
+
+
+def get_feed_last_modified(posts):
+    """Последнее изменение публикаций ленты одним агрегирующим запросом.
+
+    Изменения комментариев тоже учтены: они обновляют updated_at
+    публикации вместе со счётчиком. Для кода, у которого строк ленты на
+    руках нет; представления уже загружают страницу и берут то же время
+    из неё через ``get_last_modified`` без запроса.
+    """
+    last_modified = posts.order_by().aggregate(
+        Max('updated_at'),
+        Max('category__updated_at'),
+        Max('location__updated_at'),
+    )
+    return max(filter(None, last_modified.values()), default=None)
+
+
+def update_comment_counts(posts, **changes):
+    """Пересчитывает счётчик комментариев одним UPDATE по подзапросу.
+
+    ``changes`` — дополнительные поля для того же UPDATE.
+    """
+    from .models import Comment
+
+    comments = Comment.objects.filter(
+        post=OuterRef('pk')
+    ).order_by().values('post').annotate(total=Count('pk')).values('total')
+    return posts.update(
+        comment_count=Coalesce(Subquery(comments), 0), **changes
+    )
+
+
+def get_latest_comments(post_id, using='default'):
+    """Снимок последних комментариев публикации для Post.latest_comments.
+
+    Список словарей в порядке добавления комментариев.
+    """
+    from .models import Comment
+
+    comments = Comment.objects.using(using).filter(post_id=post_id).order_by(
+        '-created_at', '-id'
+    ).values_list('id', 'author_id', 'author__username', 'text', 'created_at')
+    return [
+        {
+            'id': pk,
+            'author_id': author_id,
+            'author': username,
+            'text': text,
+            'created_at': created_at.isoformat(),
+        }
+        for pk, author_id, username, text, created_at
+        in reversed(comments[:LATEST_COMMENTS_SIZE])
+    ]
+
+
+def update_latest_comments(post_ids, using='default'):
+    """Пересобрать снимки последних комментариев у публикаций."""
+    from .models import Post
+
+    Post.objects.using(using).bulk_update(
+        [
+            Post(
+                pk=post_id,
+                latest_comments=get_latest_comments(post_id, using),
+            )
+            for post_id in post_ids
+        ],
+        ['latest_comments'],
     )
-    return new_queryset
+
+
+def get_snapshot_comments(post):
+    """Комментарии из снимка публикации без обращения к базе."""
+    from django.contrib.auth import get_user_model
+
+    from .models import Comment
+
+    User = get_user_model()
+    return [
+        Comment(
+            pk=entry['id'],
+            post=post,
+            author=User(pk=entry['author_id'], username=entry['author']),
+            text=entry['text'],
+            created_at=parse_datetime(entry['created_at']),
+        )
+        for entry in post.latest_comments
+    ]
@@ -1,60 +1,348 @@
-from django.core.paginator import Paginator
+from functools import partial
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db import transaction
+from django.db.models import F
+from django.http import (
+    Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+)
+from django.middleware.csrf import get_token
+from django.template import Context
+from django.template.loader import get_template, render_to_string
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import http_date
+from django.utils.safestring import mark_safe
 from django.shortcuts import redirect, get_object_or_404
 from django.views.generic import (
     CreateView, DetailView, DeleteView, ListView, UpdateView
 )
 
 
+from . import comment_queue
+from .cache import (
+    FEED_INDEX, author_feed, category_feed, get_cached_page,
+    get_page_validators, get_published_category, get_versions, page_cache_key,
+    post_card_version_keys, published_author_feed, set_cached_page,
+    version_key,
+)
 from .forms import CommentForm, ProfileForm, PostForm
 from .models import Category, Comment, Post
-from .utils import get_published_posts
+from .paginators import CachedCountPaginator, CursorPage, CursorPaginator
+from .scheduling import get_feed_timeout
+from .uploads import CappedUploadMixin
+from .utils import (
+    get_last_modified, get_published_posts, get_snapshot_comments, visible_q,
+)
 
 User = get_user_model()
 
 
 # Create your views here.
-class PostListView(ListView):
+class FeedPaginationMixin:
+    """Постраничный вывод ленты: ``offset`` (?page=) или ``cursor``."""
+
+    paginate_by = 10
+    pagination_mode = 'offset'
+    paginator_class = CachedCountPaginator
+    cursor_paginator_class = CursorPaginator
+
+    def get_feed(self):
+        """Имя ленты для кеша общего количества записей."""
+        return None
+
+    def get_feed_page(self, queryset):
+        if self.pagination_mode == 'cursor':
+            paginator = self.cursor_paginator_class(
+                queryset, self.paginate_by
+            )
+            return paginator.get_page(self.request.GET.get('cursor'))
+        paginator = self.paginator_class(
+            queryset, self.paginate_by, feed=self.get_feed()
+        )
+        return paginator.get_page(self.request.GET.get('page'))
+
+    def paginate_queryset(self, queryset, page_size):
+        page = self.get_feed_page(queryset)
+        return page.paginator, page, page.object_list, page.has_other_pages()
+
+
+class ConditionalGetMixin:
+    """ETag и Last-Modified по версиям объектов страницы.
+
+    Версии берутся из ``get_page_dependencies`` до отрисовки шаблона, и,
+    если клиент прислал совпадающие валидаторы, сразу отдаётся 304.
+    """
+
+    def render_to_response(self, context, **response_kwargs):
+        self.page_versions = self.get_page_versions(context)
+        self.page_validators = get_page_validators(
+            self.page_versions,
+            self.get_viewer(),
+            self.get_page_last_modified(context),
+        )
+        return self.get_conditional_response(
+            self.page_validators,
+            partial(super().render_to_response, context, **response_kwargs),
+        )
+
+    def get_viewer(self):
+        # Формы на странице содержат CSRF-токен, а вход в систему меняет
+        # его: 304 со старым токеном привёл бы к отказу при отправке формы.
+        if not self.request.user.is_authenticated:
+            return None
+        get_token(self.request)
+        return self.request.user.pk, self.request.META['CSRF_COOKIE']
+
+    def get_conditional_response(self, validators, render):
+        etag, last_modified = validators
+        response = get_conditional_response(
+            self.request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = render()
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(
+            response,
+            no_cache=True,
+            private=self.request.user.is_authenticated,
+        )
+        return response
+
+    def get_page_versions(self, context):
+        return get_versions(self.get_page_dependencies(context))
+
+    def get_page_dependencies(self, context):
+        return [
+            key
+            for post in context['page_obj']
+            for key in post_card_version_keys(post)
+        ]
+
+    def get_page_last_modified(self, context):
+        return get_last_modified(context['page_obj'])
+
+
+class AnonymousPageCacheMixin(ConditionalGetMixin):
+    """Кеш целых страниц для анонимных посетителей.
+
+    Запись хранит версии объектов, из которых собрана страница
+    (``get_page_dependencies``), и считается устаревшей, как только любую
+    из них сбросит обработчик сигнала.
+    """
+
+    def get(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().get(request, *args, **kwargs)
+        key = page_cache_key(request)
+        entry = get_cached_page(key)
+        if entry is not None:
+            return self.get_conditional_response(
+                entry['validators'],
+                partial(
+                    HttpResponse,
+                    entry['content'],
+                    content_type=entry['content_type'],
+                ),
+            )
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200 and hasattr(response, 'render'):
+            response.add_post_render_callback(
+                lambda response: set_cached_page(
+                    key,
+                    response,
+                    self.page_versions,
+                    self.page_validators,
+                    self.get_page_timeout(),
+                )
+            )
+        return response
+
+    def get_page_timeout(self):
+        return getattr(settings, 'BLOG_PAGE_CACHE_TIMEOUT', 5 * 60)
+
+
+class PostListView(AnonymousPageCacheMixin, FeedPaginationMixin, ListView):
     model = Post
     template_name = 'blog/index.html'
     ordering = '-pub_date'
-    paginate_by = 10
+
+    def get_feed(self):
+        return FEED_INDEX
 
     def get_queryset(self):
-        return get_published_posts(self.model.objects)
+        return get_published_posts(self.model.objects).for_feed()
+
+    def get_page_dependencies(self, context):
+        return [
+            version_key('feed', FEED_INDEX),
+            *super().get_page_dependencies(context),
+        ]
+
+    def get_page_timeout(self):
+        return get_feed_timeout(self.get_feed(), super().get_page_timeout())
 
 
-class PostDetailView(DetailView):
+class VisiblePostMixin:
+    """Публикация из URL: автору — любая, остальным — только опубликованная."""
+
     model = Post
-    template_name = 'blog/detail.html'
     pk_url_kwarg = 'post_id'
 
     def get_object(self):
-        post = get_object_or_404(
-            self.model.objects.select_related('category', 'location'),
-            pk=self.kwargs['post_id'],
-        )
-        if self.request.user == post.author:
-            return post
-        published_posts = get_object_or_404(
-            get_published_posts(
-                self.model.objects.select_related('category', 'location')
+        return get_object_or_404(
+            self.model.objects.visible_to(self.request.user).select_related(
+                'author', 'category', 'location'
             ),
             pk=self.kwargs['post_id'],
         )
-        return published_posts
+
+
+class CommentPaginationMixin:
+    comments_per_page = 20
+    comments_paginator_class = CursorPaginator
+
+    def get_comments_page(self, post, cursor=None):
+        if cursor is None and (
+            post.comment_count <= len(post.latest_comments)
+            and post.comment_count <= self.comments_per_page
+        ):
+            # Снимок вмещает все комментарии: таблицу комментариев не читаем.
+            return CursorPage(get_snapshot_comments(post), None, None, None)
+        paginator = self.comments_paginator_class(
+            post.comments.select_related('author'),
+            self.comments_per_page,
+            ordering=('created_at', 'id'),
+        )
+        return paginator.get_page(cursor)
+
+
+class StreamingCommentsMixin:
+    """Потоковая отдача страницы публикации со всеми комментариями.
+
+    Сначала отправляется страница до списка комментариев, затем
+    комментарии, прочитанные через ``.iterator()`` пачками по
+    ``comments_chunk_size``, и в конце остаток страницы. Ответ не
+    собирается в памяти целиком.
+    """
+
+    stream_comments = False
+    comments_chunk_size = 200
+    comment_template_name = 'includes/comment.html'
+    comments_marker = '<!-- blog:comments -->'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if self.stream_comments:
+            context['comments_stream_marker'] = mark_safe(
+                self.comments_marker
+            )
+        return context
+
+    def render_to_response(self, context, **response_kwargs):
+        if not self.stream_comments:
+            return super().render_to_response(context, **response_kwargs)
+        page = render_to_string(
+            self.get_template_names(), context, self.request
+        )
+        head, tail = page.split(self.comments_marker, 1)
+        return StreamingHttpResponse(
+            self.stream_page(head, tail),
+            content_type=response_kwargs.get('content_type'),
+        )
+
+    def stream_page(self, head, tail):
+        yield head
+        template = get_template(self.comment_template_name).template
+        context = Context({'post': self.object, 'user': self.request.user})
+        comments = self.object.comments.select_related('author').order_by(
+            'created_at', 'id'
+        ).iterator(chunk_size=self.comments_chunk_size)
+        chunk = []
+        for comment in comments:
+            with context.push(comment=comment):
+                chunk.append(template.render(context))
+            if len(chunk) == self.comments_chunk_size:
+                yield ''.join(chunk)
+                chunk = []
+        yield ''.join(chunk)
+        yield tail
+
+
+class PostDetailView(
+    AnonymousPageCacheMixin, VisiblePostMixin, StreamingCommentsMixin,
+    CommentPaginationMixin, DetailView,
+):
+    template_name = 'blog/detail.html'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         if self.request.user.is_authenticated:
             context['form'] = CommentForm()
-        context['comments'] = (
-            self.object.comments.select_related('author')
+        if not self.stream_comments:
+            # Страница комментариев читается только при отрисовке, чтобы
+            # ответ 304 обходился без запроса к таблице комментариев.
+            context['comments'] = SimpleLazyObject(
+                partial(self.get_comments_page, self.object)
+            )
+        context['pending_comments'] = comment_queue.get_pending_comments(
+            self.object, self.request.user
         )
         return context
 
+    def get_page_versions(self, context):
+        # Свои комментарии из очереди автор видит до записи в базу,
+        # поэтому они тоже входят в ETag страницы.
+        versions = super().get_page_versions(context)
+        for comment in context['pending_comments']:
+            key = f'pending:{comment.created_at.isoformat()}'
+            versions[key] = int(comment.created_at.timestamp()) * 10 ** 9
+        return versions
+
+    def get_page_dependencies(self, context):
+        return post_card_version_keys(self.object)
+
+    def get_page_last_modified(self, context):
+        return get_last_modified([self.object])
+
+
+class CommentListView(VisiblePostMixin, CommentPaginationMixin, DetailView):
+    """Следующая страница комментариев: HTML-фрагмент или JSON."""
+
+    template_name = 'includes/comment_list.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['comments'] = self.get_comments_page(
+            self.object, self.request.GET.get('cursor')
+        )
+        return context
+
+    def render_to_response(self, context, **response_kwargs):
+        if self.request.GET.get('format') != 'json':
+            return super().render_to_response(context, **response_kwargs)
+        comments = context['comments']
+        return JsonResponse({
+            'comments': [
+                {
+                    'id': comment.id,
+                    'author': comment.author.username,
+                    'text': comment.text,
+                    'created_at': comment.created_at,
+                }
+                for comment in comments
+            ],
+            'next_cursor': comments.next_cursor,
+            'html': render_to_string(
+                self.template_name, context, self.request
+            ),
+        })
+
 
 class ProfileRedirectionMixin(LoginRequiredMixin):
 
@@ -62,7 +350,7 @@ class ProfileRedirectionMixin(LoginRequiredMixin):
         return reverse('blog:profile', kwargs={'username': self.request.user})
 
 
-class PostCreateView(ProfileRedirectionMixin, CreateView):
+class PostCreateView(CappedUploadMixin, ProfileRedirectionMixin, CreateView):
     model = Post
     form_class = PostForm
     template_name = 'blog/create.html'
@@ -86,11 +374,8 @@ class AuthorRequiredMixin(LoginRequiredMixin):
         return self.model.objects.filter(author=self.request.user)
 
 
-class PostUpdateView(PostRedirectionMixin, UpdateView):
-    model = Post
-    form_class = PostForm
-    template_name = 'blog/create.html'
-    pk_url_kwarg = 'post_id'
+class PostAuthorRedirectMixin:
+    """Не автора публикации отправляет на её страницу."""
 
     def dispatch(self, request, *args, **kwargs):
         post = get_object_or_404(self.model, id=self.kwargs['post_id'])
@@ -104,6 +389,16 @@ class PostUpdateView(PostRedirectionMixin, UpdateView):
         return super().dispatch(request, *args, **kwargs)
 
 
+class PostUpdateView(
+    CappedUploadMixin, PostAuthorRedirectMixin, PostRedirectionMixin,
+    UpdateView,
+):
+    model = Post
+    form_class = PostForm
+    template_name = 'blog/create.html'
+    pk_url_kwarg = 'post_id'
+
+
 class PostDeleteView(AuthorRequiredMixin, ProfileRedirectionMixin, DeleteView):
     model = Post
     template_name = 'blog/create.html'
@@ -117,44 +412,131 @@ class PostDeleteView(AuthorRequiredMixin, ProfileRedirectionMixin, DeleteView):
         return context
 
 
-class CategoryDetailView(DetailView):
+class CategoryDetailView(
+    AnonymousPageCacheMixin, FeedPaginationMixin, DetailView
+):
     model = Category
     template_name = 'blog/category.html'
     context_object_name = 'category'
     slug_url_kwarg = 'category_slug'
 
     def get_object(self):
-        return get_object_or_404(
-            self.model.objects,
-            slug=self.kwargs['category_slug'],
-            is_published=True,
-        )
+        category = get_published_category(self.kwargs['category_slug'])
+        if category is None:
+            raise Http404('Категория не найдена.')
+        return category
+
+    def get_feed(self):
+        return category_feed(self.object.pk)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        posts = get_published_posts(self.object.category.all())
-        paginator = Paginator(posts, 10)
-        page_number = self.request.GET.get('page')
-        context['page_obj'] = paginator.get_page(page_number)
+        # Категория уже проверена и подставляется в публикации менеджером
+        # связи, поэтому в запросе ленты её таблица не участвует.
+        posts = self.object.category.published(
+            category=False
+        ).for_feed(category=False)
+        context['page_obj'] = self.get_feed_page(posts)
         return context
 
+    def get_page_dependencies(self, context):
+        return [
+            version_key('feed', self.get_feed()),
+            version_key('category', self.object.pk),
+            *super().get_page_dependencies(context),
+        ]
+
+    def get_page_timeout(self):
+        return get_feed_timeout(self.get_feed(), super().get_page_timeout())
+
 
-class ProfileDetailView(DetailView):
+class ProfileMixin:
     model = User
     template_name = 'blog/profile.html'
     slug_field = 'username'
     slug_url_kwarg = 'username'
     context_object_name = 'profile'
+    tab = 'posts'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['tab'] = self.tab
+        return context
+
+
+class ProfileDetailView(
+    ProfileMixin, ConditionalGetMixin, FeedPaginationMixin, DetailView
+):
+
+    def is_owner(self):
+        return self.request.user == self.object
+
+    def get_feed(self):
+        if self.is_owner():
+            return author_feed(self.object.pk)
+        return published_author_feed(self.object.pk)
+
+    def get_page_dependencies(self, context):
+        return [
+            version_key('feed', self.get_feed()),
+            version_key('user', self.object.pk),
+            *super().get_page_dependencies(context),
+        ]
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        # Автор видит все свои публикации, остальные — только опубликованные.
+        # Обе выборки идут по индексу post_author_feed_idx.
         posts = self.object.author.all()
-        paginator = Paginator(posts, 10)
-        page_number = self.request.GET.get('page')
-        context['page_obj'] = paginator.get_page(page_number)
+        if not self.is_owner():
+            posts = posts.published()
+        context['page_obj'] = self.get_feed_page(posts.for_feed())
         return context
 
 
+class ProfileCommentsView(ProfileMixin, ConditionalGetMixin, DetailView):
+    """Комментарии пользователя, новые сверху, с постраничным выводом по
+    ключу ``(created_at, id)`` — по индексу comment_author_idx."""
+
+    tab = 'comments'
+    paginate_by = 20
+    paginator_class = CursorPaginator
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        comments = Comment.objects.filter(
+            visible_q(self.request.user, prefix='post__'),
+            author=self.object,
+        ).select_related('post')
+        paginator = self.paginator_class(
+            comments, self.paginate_by, ordering=('-created_at', '-id')
+        )
+        context['page_obj'] = paginator.get_page(
+            self.request.GET.get('cursor')
+        )
+        return context
+
+    def get_page_dependencies(self, context):
+        return [
+            version_key('user', self.object.pk),
+            version_key('user-comments', self.object.pk),
+            *(
+                version_key('post', comment.post_id)
+                for comment in context['page_obj']
+            ),
+        ]
+
+    def get_page_last_modified(self, context):
+        return max(
+            (
+                obj.updated_at
+                for comment in context['page_obj']
+                for obj in (comment, comment.post)
+            ),
+            default=None,
+        )
+
+
 class ProfileUpdateView(ProfileRedirectionMixin, UpdateView):
     model = User
     form_class = ProfileForm
@@ -171,13 +553,37 @@ class CommentCreateView(PostRedirectionMixin, CreateView):
     pk_url_kwarg = 'post_id'
 
     def form_valid(self, form):
-        post = get_object_or_404(
-            Post.objects.select_related('category', 'location'),
+        if comment_queue.is_enabled():
+            return self.enqueue(form)
+        form.instance.author = self.request.user
+        form.instance.post_id = self.kwargs['post_id']
+        with transaction.atomic():
+            # Проверка видимости публикации и обновление счётчика — один
+            # UPDATE; обработчик сигнала повторно счётчик не трогает.
+            found = Post.objects.visible_to(self.request.user).filter(
+                pk=self.kwargs['post_id']
+            ).update(
+                comment_count=F('comment_count') + 1,
+                updated_at=timezone.now(),
+            )
+            if not found:
+                raise Http404('Публикация не найдена.')
+            form.instance._post_counted = True
+            return super().form_valid(form)
+
+    def enqueue(self, form):
+        # В режиме очереди запрос только читает базу; комментарий
+        # добавит обработчик очереди.
+        if not Post.objects.visible_to(self.request.user).filter(
             pk=self.kwargs['post_id']
+        ).exists():
+            raise Http404('Публикация не найдена.')
+        comment_queue.enqueue_comment(
+            self.kwargs['post_id'],
+            self.request.user.pk,
+            form.cleaned_data['text'],
         )
-        form.instance.author = self.request.user
-        form.instance.post = post
-        return super().form_valid(form)
+        return redirect(self.get_success_url())
 
 
 class CommentMixin(AuthorRequiredMixin, PostRedirectionMixin):
@@ -185,10 +591,19 @@ class CommentMixin(AuthorRequiredMixin, PostRedirectionMixin):
     template_name = 'blog/comment.html'
     pk_url_kwarg = 'comment_id'
 
+    def get_queryset(self):
+        return super().get_queryset().filter(
+            visible_q(self.request.user, prefix='post__'),
+            post_id=self.kwargs['post_id'],
+        )
+
 
 class CommentUpdateView(CommentMixin, UpdateView):
     form_class = CommentForm
 
 
 class CommentDeleteView(CommentMixin, DeleteView):
-    pass
+
+    @transaction.atomic
+    def delete(self, request, *args, **kwargs):
+        return super().delete(request, *args, **kwargs)
@@ -89,6 +89,61 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+# Кеш должен быть общим для всех процессов приложения: версии объектов
+# (blog.cache) сбрасывает процесс, который изменил объект, а кеш
+# процесса-соседа (LocMemCache) о сбросе не узнает и продолжит отдавать
+# старые страницы, счётчики ленты и заголовки категорий. На нескольких
+# серверах нужен Redis или Memcached; проверка blog.W001 предупреждает о
+# кеше в памяти процесса.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+    }
+}
+
+# Сколько секунд хранить общее количество публикаций в ленте. Срок
+# дополнительно ограничен временем ближайшей отложенной публикации.
+BLOG_FEED_COUNT_TIMEOUT = 60 * 60
+
+# Сколько секунд хранить время ближайшей отложенной публикации ленты.
+BLOG_SCHEDULE_TIMEOUT = 60 * 60
+
+# Начиная с какого числа строк брать оценку планировщика вместо COUNT(*)
+# (только PostgreSQL); None — всегда считать точно.
+BLOG_FEED_COUNT_ESTIMATE_THRESHOLD = None
+
+# Сколько секунд хранить отрисованную карточку публикации.
+BLOG_POST_CARD_TIMEOUT = 60 * 60
+
+# Сколько секунд хранить опубликованную категорию для страницы категории.
+BLOG_CATEGORY_TIMEOUT = 60 * 60
+
+# Сколько секунд хранить страницы ленты и публикаций для анонимов.
+BLOG_PAGE_CACHE_TIMEOUT = 5 * 60
+
+# Каталог очереди комментариев с отложенной записью в базу (см.
+# blog.comment_queue); None — комментарии пишутся в базу сразу.
+BLOG_COMMENT_QUEUE_DIR = None
+
+# Предельный размер файла изображения публикации в байтах и предельное
+# число пикселей: большие изображения отклоняются по заголовку.
+BLOG_IMAGE_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+BLOG_IMAGE_MAX_PIXELS = 40 * 10 ** 6
+
+# Кто отдаёт загруженные файлы (см. blog.media): None — само приложение,
+# 'x-accel-redirect' — nginx из internal-раздела BLOG_MEDIA_ACCEL_PREFIX,
+# 'x-sendfile' — Apache с mod_xsendfile.
+BLOG_MEDIA_ACCEL = None
+BLOG_MEDIA_ACCEL_PREFIX = '/internal-media/'
+
+# Сколько секунд клиенты кешируют файлы без хеша содержимого в имени.
+BLOG_MEDIA_MAX_AGE = 60 * 60
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -146,6 +201,8 @@ LOGIN_REDIRECT_URL = 'blog:index'
 
 MEDIA_ROOT = BASE_DIR / 'media'
 
+MEDIA_URL = '/media/'
+
 EMAIL_BACKEND = 'django.core.mail.backends.<тип бэкенда>.EmailBackend'
 
 EMAIL_FILE_PATH = BASE_DIR / 'sent_emails'
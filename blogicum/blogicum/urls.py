@@ -13,12 +13,16 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+from urllib.parse import urlsplit
+
 from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib import admin
 from django.contrib.auth.forms import UserCreationForm
 from django.views.generic.edit import CreateView
-from django.urls import include, path, reverse_lazy
+from django.urls import include, path, re_path, reverse_lazy
+
+from blog.media import MediaView
 
 handler404 = 'pages.views.page_not_found'
 handler500 = 'pages.views.internal_server_error'
@@ -37,4 +41,11 @@ urlpatterns = [
     ),
     path('auth/', include('django.contrib.auth.urls')),
     path('admin/', admin.site.urls),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
+
+if not urlsplit(settings.MEDIA_URL).netloc:
+    urlpatterns.append(re_path(
+        r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')),
+        MediaView.as_view(),
+        name='media',
+    ))